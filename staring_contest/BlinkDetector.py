@@ -0,0 +1,98 @@
+import time
+from collections import deque, namedtuple
+
+import numpy
+
+# time: when the eyes closed, duration: seconds until they opened again,
+# frames: how many frames they were closed for
+BlinkEvent = namedtuple('BlinkEvent', ['time', 'duration', 'frames'])
+
+
+class BlinkDetector:
+    """Turns per-frame blink flags from the pipeline into blink events.
+
+    A blink is at least pre_open open frames, then between min_closed and
+    max_closed closed frames, then post_open open frames. The defaults are
+    the old [0, 0, 1, 0, 0] pattern. Instead of comparing a window of
+    flags every frame, update() keeps the lengths of the current runs, so
+    it costs the same whatever the pattern or history length. A blink that
+    closes within `debounce` seconds of the previous one is ignored.
+
+    The last `history` flags and their timestamps are kept in a ring
+    buffer, and the blink times of the last `rate_window` seconds give the
+    blink rate, which depends on timestamps rather than the frame rate.
+    """
+
+    def __init__(self, pre_open=2, min_closed=1, max_closed=1, post_open=2, debounce=0.0, history=64,
+                 rate_window=60.0):
+        self.pre_open = pre_open
+        self.min_closed = min_closed
+        self.max_closed = max_closed
+        self.post_open = post_open
+        self.debounce = debounce
+        self.rate_window = rate_window
+        self.blinks = 0
+        self.frames = 0
+
+        self.__flags = numpy.zeros(history, dtype=numpy.uint8)
+        self.__times = numpy.zeros(history, dtype=numpy.float64)
+        self.__blink_times = deque()
+        self.__last_blink = None
+        # lengths of the current runs of open and closed frames
+        self.__open = 0
+        self.__closed = 0
+        # the open run before the closed run, and when the closed run started and ended
+        self.__open_before = 0
+        self.__closed_at = None
+        self.__opened_at = None
+
+    def update(self, blink, timestamp=None):
+        """Adds the next frame's flag. Returns a BlinkEvent when it completes a blink, otherwise None."""
+        if timestamp is None:
+            timestamp = time.time()
+        slot = self.frames % len(self.__flags)
+        self.__flags[slot] = 1 if blink else 0
+        self.__times[slot] = timestamp
+        self.frames += 1
+
+        if blink:
+            if self.__closed == 0 or self.__open > 0:
+                # a new closed run, even if the last one never got its post_open frames
+                self.__open_before = self.__open
+                self.__closed = 0
+                self.__closed_at = timestamp
+            self.__closed += 1
+            self.__open = 0
+            return None
+
+        self.__open += 1
+        if self.__open == 1:
+            self.__opened_at = timestamp
+        if self.__closed == 0 or self.__open < self.post_open:
+            return None
+
+        closed = self.__closed
+        self.__closed = 0
+        if self.__open_before < self.pre_open or not self.min_closed <= closed <= self.max_closed:
+            return None
+        if self.__last_blink is not None and self.__closed_at - self.__last_blink < self.debounce:
+            return None
+        self.__last_blink = self.__closed_at
+        self.__blink_times.append(self.__closed_at)
+        self.blinks += 1
+        return BlinkEvent(self.__closed_at, self.__opened_at - self.__closed_at, closed)
+
+    def blink_rate(self, now=None):
+        """Blinks per minute over the last rate_window seconds."""
+        if now is None:
+            now = self.__times[(self.frames - 1) % len(self.__times)] if self.frames else time.time()
+        while self.__blink_times and self.__blink_times[0] < now - self.rate_window:
+            self.__blink_times.popleft()
+        return 60.0 * len(self.__blink_times) / self.rate_window
+
+    def history(self):
+        """Returns the last flags and their timestamps, oldest first."""
+        n = min(self.frames, len(self.__flags))
+        start = (self.frames - n) % len(self.__flags)
+        order = (numpy.arange(n) + start) % len(self.__flags)
+        return self.__flags[order], self.__times[order]
@@ -3,6 +3,8 @@ import numpy
 import math
 from enum import Enum
 
+from ComponentBlobs import ComponentBlobDetector
+
 class Pipeline:
     """This is a generated class from GRIP.
     To use the pipeline first create a improved_pipeline instance and set the sources,
@@ -10,12 +12,27 @@ class Pipeline:
     finally get and use the outputs.
     """
     
-    def __init__(self):
+    def __init__(self, preallocate=False, blob_backend=None, profiler=None):
         """initializes all values to presets or None if need to be set
+        Args:
+            preallocate: If true every step writes into buffers owned by the pipeline,
+                which are only reallocated when the source shape changes.
+            blob_backend: A BlobBackend. Defaults to BlobBackend.Simple_Blob.
+            profiler: An optional StageProfiler that times every step.
         """
         self.__lastImage0 = numpy.ndarray([])
         self.__source0 = None
 
+        self.preallocate = preallocate
+        self.profiler = profiler
+        self.reallocations = 0
+        self.__buffers_shape = None
+        self.__last_buffer = None
+        self.__threshold_moving_buffer = None
+        self.__blur_buffer = None
+        self.__cv_threshold_buffer = None
+        self.__cv_adaptivethreshold_buffer = None
+
         self.threshold_moving_output = None
 
         self.__blur_input = self.threshold_moving_output
@@ -41,6 +58,9 @@ class Pipeline:
         self.__find_blobs_min_area = 56.0
         self.__find_blobs_circularity = [0.0, 1.0]
         self.__find_blobs_dark_blobs = False
+        self.__find_blobs_backend = blob_backend or BlobBackend.Simple_Blob
+        self.__find_blobs_detector = None
+        self.detector_builds = 0
         self.find_blobs_output = None
 
     
@@ -49,87 +69,221 @@ class Pipeline:
         Sets outputs to new values.
         Requires all sources to be set.
         """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        if self.preallocate:
+            self.__ensure_buffers(self.__source0)
+
         #Step Threshold_Moving0:
         self.__threshold_moving_image = self.__source0
-        (self.__lastImage0, self.threshold_moving_output ) = self.__threshold_moving(self.__threshold_moving_image, self.__lastImage0)
+        (self.__lastImage0, self.threshold_moving_output ) = self.__threshold_moving(self.__threshold_moving_image, self.__lastImage0, self.__threshold_moving_buffer)
+        if self.preallocate:
+            # keep our own copy, the caller may reuse the source array
+            numpy.copyto(self.__last_buffer, self.__threshold_moving_image)
+            self.__lastImage0 = self.__last_buffer
+        if profiler is not None:
+            profiler.mark('Threshold_Moving')
 
+        self.__process_moving(profiler)
+
+    def process_batch(self, frames):
+        """Runs the pipeline over a recorded sequence in one call.
+        Gives the same results as set_source0/process on each frame in turn, and
+        carries the temporal state over from and to the streaming path.
+        Args:
+            frames: An (N, H, W) numpy.ndarray stack of frames.
+        Returns:
+            A (blinks, blob_counts) pair of length N arrays, where blinks is
+            min(1, blob count) as returned by GripWrapper.run.
+        """
+        assert isinstance(frames, numpy.ndarray) and frames.ndim == 3, "Frames must be an (N, H, W) numpy.ndarray"
+        frames = numpy.ascontiguousarray(frames)
+        n, h, w = frames.shape
+        blob_counts = numpy.zeros(n, dtype=numpy.int32)
+        if n == 0:
+            return blob_counts.astype(numpy.uint8), blob_counts
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        self.__ensure_buffers(frames[0])
+
+        # Step Threshold_Moving0 for the whole stack: every frame against the one before it
+        diffs = numpy.empty_like(frames)
+        self.__threshold_moving(frames[0], self.__lastImage0, diffs[0])
+        if n > 1:
+            cv2.absdiff(frames[1:].reshape(-1, w), frames[:-1].reshape(-1, w), dst=diffs[1:].reshape(-1, w))
+        numpy.copyto(self.__last_buffer, frames[-1])
+        self.__lastImage0 = self.__last_buffer
+        if profiler is not None:
+            profiler.mark('Threshold_Moving', frames=n)
+
+        for i in range(n):
+            self.threshold_moving_output = diffs[i]
+            if profiler is not None:
+                profiler.start()
+            self.__process_moving(profiler)
+            blob_counts[i] = len(self.find_blobs_output)
+        if not self.preallocate:
+            # the batch buffers only last for the batch, process() allocates per frame again
+            self.__release_buffers()
+        return numpy.minimum(blob_counts, 1).astype(numpy.uint8), blob_counts
+
+    def __process_moving(self, profiler=None):
+        """Runs every step after Threshold_Moving0 on threshold_moving_output.
+        """
         #Step Blur0:
         self.__blur_input = self.threshold_moving_output
-        (self.blur_output ) = self.__blur(self.__blur_input, self.__blur_type, self.__blur_radius)
+        (self.blur_output ) = self.__blur(self.__blur_input, self.__blur_type, self.__blur_radius, self.__blur_buffer)
+        if profiler is not None:
+            profiler.mark('Blur')
 
         #Step CV_Threshold0:
         self.__cv_threshold_src = self.blur_output
-        (self.cv_threshold_output ) = self.__cv_threshold(self.__cv_threshold_src, self.__cv_threshold_thresh, self.__cv_threshold_maxval, self.__cv_threshold_type)
+        (self.cv_threshold_output ) = self.__cv_threshold(self.__cv_threshold_src, self.__cv_threshold_thresh, self.__cv_threshold_maxval, self.__cv_threshold_type, self.__cv_threshold_buffer)
+        if profiler is not None:
+            profiler.mark('CV_Threshold')
 
         #Step CV_adaptiveThreshold0:
         self.__cv_adaptivethreshold_src = self.cv_threshold_output
-        (self.cv_adaptivethreshold_output ) = self.__cv_adaptivethreshold(self.__cv_adaptivethreshold_src, self.__cv_adaptivethreshold_maxvalue, self.__cv_adaptivethreshold_adaptivemethod, self.__cv_adaptivethreshold_thresholdtype, self.__cv_adaptivethreshold_blocksize, self.__cv_adaptivethreshold_c)
+        (self.cv_adaptivethreshold_output ) = self.__cv_adaptivethreshold(self.__cv_adaptivethreshold_src, self.__cv_adaptivethreshold_maxvalue, self.__cv_adaptivethreshold_adaptivemethod, self.__cv_adaptivethreshold_thresholdtype, self.__cv_adaptivethreshold_blocksize, self.__cv_adaptivethreshold_c, self.__cv_adaptivethreshold_buffer)
+        if profiler is not None:
+            profiler.mark('CV_adaptiveThreshold')
 
         #Step Find_Blobs0:
         self.__find_blobs_input = self.cv_adaptivethreshold_output
-        (self.find_blobs_output ) = self.__find_blobs(self.__find_blobs_input, self.__find_blobs_min_area, self.__find_blobs_circularity, self.__find_blobs_dark_blobs)
+        if self.__find_blobs_detector is None:
+            self.__find_blobs_detector = create_blob_detector(self.__find_blobs_min_area, self.__find_blobs_circularity, self.__find_blobs_dark_blobs, self.__find_blobs_backend)
+            self.detector_builds += 1
+        (self.find_blobs_output ) = self.__find_blobs(self.__find_blobs_input, self.__find_blobs_detector)
+        if profiler is not None:
+            profiler.mark('Find_Blobs')
 
     def set_source0(self, value):
         """Sets source0 to given value checking for correct type.
         """
         assert isinstance(value, numpy.ndarray) , "Source must be of type numpy.ndarray"
         self.__source0 = value
+
+    def set_find_blobs_min_area(self, value):
+        """Sets the minimum blob area, rebuilding the blob detector only if it changed.
+        """
+        if value != self.__find_blobs_min_area:
+            self.__find_blobs_min_area = value
+            self.__find_blobs_detector = None
+
+    def set_find_blobs_circularity(self, value):
+        """Sets the [min, max] blob circularity, rebuilding the blob detector only if it changed.
+        """
+        value = list(value)
+        if value != self.__find_blobs_circularity:
+            self.__find_blobs_circularity = value
+            self.__find_blobs_detector = None
+
+    def set_find_blobs_dark_blobs(self, value):
+        """Sets whether to look for dark blobs, rebuilding the blob detector only if it changed.
+        """
+        if value != self.__find_blobs_dark_blobs:
+            self.__find_blobs_dark_blobs = value
+            self.__find_blobs_detector = None
+
+    def set_find_blobs_backend(self, value):
+        """Selects the BlobBackend used by Find_Blobs.
+        """
+        if value is not self.__find_blobs_backend:
+            self.__find_blobs_backend = value
+            self.__find_blobs_detector = None
     
 
 
+    def __ensure_buffers(self, source):
+        """(Re)allocates the stage buffers if the source shape or type changed."""
+        if self.__buffers_shape == (source.shape, source.dtype):
+            return
+        self.__buffers_shape = (source.shape, source.dtype)
+        self.__last_buffer = numpy.empty_like(source)
+        self.__threshold_moving_buffer = numpy.empty_like(source)
+        self.__blur_buffer = numpy.empty_like(source)
+        self.__cv_threshold_buffer = numpy.empty_like(source)
+        self.__cv_adaptivethreshold_buffer = numpy.empty_like(source)
+        # the previous frame can only be diffed against a source just like it
+        if (self.__lastImage0.shape, self.__lastImage0.dtype) != self.__buffers_shape:
+            self.__lastImage0 = numpy.ndarray([])
+        if self.preallocate:
+            self.reallocations += 1
+
+    def __release_buffers(self):
+        """Drops the stage buffers, keeping the last frame for Threshold_Moving0."""
+        self.__buffers_shape = None
+        self.__last_buffer = None
+        self.__threshold_moving_buffer = None
+        self.__blur_buffer = None
+        self.__cv_threshold_buffer = None
+        self.__cv_adaptivethreshold_buffer = None
+
     @staticmethod
-    def __threshold_moving(input, last_image):
+    def __threshold_moving(input, last_image, dst=None):
         """Thresholds off parts of the image that have moved or changed between
            the previous and next image.
         Args:
             input: A numpy.ndarray.
             last_image: The previous value of the numpy.ndarray.
+            dst: Optional numpy.ndarray to write the output into, used only if it
+                has the shape of input.
         Returns:
             A numpy.ndarray with the parts that are the same in black.
+            With no usable previous image, everything is black.
         """
+        if dst is not None and dst.shape != input.shape:
+            dst = None
         if (last_image.shape == input.shape):
-            output =  cv2.absdiff(input, last_image)
+            output =  cv2.absdiff(input, last_image, dst=dst)
+        elif dst is None:
+            output = numpy.zeros(shape=input.shape, dtype=input.dtype)
         else:
-            output = numpy.ndarray(shape=input.shape, dtype=input.dtype)
+            output = dst
+            output.fill(0)
         return input, output
 
     @staticmethod
-    def __blur(src, type, radius):
+    def __blur(src, type, radius, dst=None):
         """Softens an image using one of several filters.
         Args:
             src: The source mat (numpy.ndarray).
             type: The blurType to perform represented as an int.
             radius: The radius for the blur as a float.
+            dst: Optional numpy.ndarray to write the output into.
         Returns:
             A numpy.ndarray that has been blurred.
         """
         if(type is BlurType.Box_Blur):
             ksize = int(2 * round(radius) + 1)
-            return cv2.blur(src, (ksize, ksize))
+            return cv2.blur(src, (ksize, ksize), dst=dst)
         elif(type is BlurType.Gaussian_Blur):
             ksize = int(6 * round(radius) + 1)
-            return cv2.GaussianBlur(src, (ksize, ksize), round(radius))
+            return cv2.GaussianBlur(src, (ksize, ksize), round(radius), dst=dst)
         elif(type is BlurType.Median_Filter):
             ksize = int(2 * round(radius) + 1)
-            return cv2.medianBlur(src, ksize)
+            return cv2.medianBlur(src, ksize, dst=dst)
         else:
-            return cv2.bilateralFilter(src, -1, round(radius), round(radius))
+            return cv2.bilateralFilter(src, -1, round(radius), round(radius), dst=dst)
 
     @staticmethod
-    def __cv_threshold(src, thresh, max_val, type):
+    def __cv_threshold(src, thresh, max_val, type, dst=None):
         """Apply a fixed-level threshold to each array element in an image
         Args:
             src: A numpy.ndarray.
             thresh: Threshold value.
             max_val: Maximum value for THRES_BINARY and THRES_BINARY_INV.
             type: Opencv enum.
+            dst: Optional numpy.ndarray to write the output into.
         Returns:
             A black and white numpy.ndarray.
         """
-        return cv2.threshold(src, thresh, max_val, type)[1]
+        return cv2.threshold(src, thresh, max_val, type, dst=dst)[1]
 
     @staticmethod
-    def __cv_adaptivethreshold(src, max_value, adaptive_method, threshold_type, block_size, c):
+    def __cv_adaptivethreshold(src, max_value, adaptive_method, threshold_type, block_size, c, dst=None):
         """Applies an adaptive threshold to an array.
         Args:
             src: A gray scale numpy.ndarray.
@@ -138,38 +292,53 @@ class Pipeline:
             threshold_type: Type of threshold to use. (opencv enum)
             block_size: Size of a pixel area that is used to calculate a threshold.(number)
             c: Constant to subtract from the mean.(number)
+            dst: Optional numpy.ndarray to write the output into.
         Returns:
             A black and white numpy.ndarray.
         """
         return cv2.adaptiveThreshold(src, max_value, adaptive_method, threshold_type,
-                        (int)(block_size + 0.5), c)
+                        (int)(block_size + 0.5), c, dst=dst)
 
     @staticmethod
-    def __find_blobs(input, min_area, circularity, dark_blobs):
+    def __find_blobs(input, detector):
         """Detects groups of pixels in an image.
         Args:
             input: A numpy.ndarray.
-            min_area: The minimum blob size to be found.
-            circularity: The min and max circularity as a list of two numbers.
-            dark_blobs: A boolean. If true looks for black. Otherwise it looks for white.
+            detector: The detector from create_blob_detector.
         Returns:
             A list of KeyPoint.
         """
-        params = cv2.SimpleBlobDetector_Params()
-        params.filterByColor = 1
-        params.blobColor = (0 if dark_blobs else 255)
-        params.minThreshold = 10
-        params.maxThreshold = 220
-        params.filterByArea = True
-        params.minArea = min_area
-        params.filterByCircularity = True
-        params.minCircularity = circularity[0]
-        params.maxCircularity = circularity[1]
-        params.filterByConvexity = False
-        params.filterByInertia = False
-        detector = cv2.SimpleBlobDetector_create(params)
         return detector.detect(input)
 
 
 BlurType = Enum('BlurType', 'Box_Blur Gaussian_Blur Median_Filter Bilateral_Filter')
 
+BlobBackend = Enum('BlobBackend', 'Simple_Blob Connected_Components')
+
+
+def create_blob_detector(min_area, circularity, dark_blobs, backend):
+    """Builds the detector used by the Find_Blobs step.
+    Args:
+        min_area: The minimum blob size to be found.
+        circularity: The min and max circularity as a list of two numbers.
+        dark_blobs: A boolean. If true looks for black. Otherwise it looks for white.
+        backend: The BlobBackend to build.
+    Returns:
+        A cv2.SimpleBlobDetector or a ComponentBlobDetector.
+    """
+    params = cv2.SimpleBlobDetector_Params()
+    params.filterByColor = 1
+    params.blobColor = (0 if dark_blobs else 255)
+    params.minThreshold = 10
+    params.maxThreshold = 220
+    params.filterByArea = True
+    params.minArea = min_area
+    params.filterByCircularity = True
+    # newer OpenCV versions reject a minimum circularity of exactly 0
+    params.minCircularity = max(circularity[0], 1e-6)
+    params.maxCircularity = circularity[1]
+    params.filterByConvexity = False
+    params.filterByInertia = False
+    if backend is BlobBackend.Connected_Components:
+        return ComponentBlobDetector(params)
+    return cv2.SimpleBlobDetector_create(params)
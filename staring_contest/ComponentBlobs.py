@@ -0,0 +1,96 @@
+import math
+
+import cv2
+import numpy
+
+
+class ComponentBlobDetector:
+    """A drop-in for cv2.SimpleBlobDetector on images that are already binary.
+
+    SimpleBlobDetector re-thresholds its input at every step between
+    minThreshold and maxThreshold and traces every contour each time, which
+    on a binary image repeats identical work ~20 times. This labels the
+    image once with connectedComponentsWithStats, skips components whose
+    bounding box is too small to hold a blob of minArea, and traces contours
+    only inside the bounding boxes of the rest. The area, circularity and
+    color filters, and the way blobs found at each threshold are grouped
+    into keypoints, follow SimpleBlobDetector.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.thresholds = len(numpy.arange(params.minThreshold, min(params.maxThreshold, 255), params.thresholdStep))
+
+    def detect(self, input):
+        params = self.params
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(input, connectivity=8)
+        centers = []
+        for label in range(1, count):
+            x, y, w, h = stats[label, :4]
+            # no contour of this component can enclose more than its bounding box
+            if params.filterByArea and w * h < params.minArea:
+                continue
+            mask = numpy.zeros((h + 2, w + 2), dtype=numpy.uint8)
+            mask[1:-1, 1:-1][labels[y:y + h, x:x + w] == label] = 255
+            contours = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE,
+                                        offset=(int(x) - 1, int(y) - 1))[-2]
+            for contour in contours:
+                center = self.__check_contour(input, contour)
+                if center is not None:
+                    centers.append((tuple(contour[0, 0][::-1]), center))
+        # findContours(RETR_LIST) on the whole image lists contours in reverse
+        # order of where its raster scan first met them
+        centers.sort(key=lambda item: item[0], reverse=True)
+        return self.__group([center for _, center in centers])
+
+    def __check_contour(self, input, contour):
+        params = self.params
+        moments = cv2.moments(contour)
+        area = moments['m00']
+        if params.filterByArea and (area < params.minArea or area >= params.maxArea):
+            return None
+        if params.filterByCircularity:
+            perimeter = cv2.arcLength(contour, True)
+            ratio = 4 * math.pi * area / (perimeter * perimeter)
+            if ratio < params.minCircularity or ratio >= params.maxCircularity:
+                return None
+        if area == 0.0:
+            return None
+        cx = moments['m10'] / area
+        cy = moments['m01'] / area
+        if params.filterByColor and input[int(round(cy)), int(round(cx))] != params.blobColor:
+            return None
+        distances = numpy.sort(numpy.hypot(contour[:, 0, 0] - cx, contour[:, 0, 1] - cy))
+        radius = (distances[(len(distances) - 1) // 2] + distances[len(distances) // 2]) / 2.0
+        return cx, cy, radius
+
+    def __group(self, found):
+        """Replays SimpleBlobDetector's grouping of the blobs found at each
+        threshold, which on a binary image are the same blobs every time."""
+        params = self.params
+        groups = []
+        for _ in range(self.thresholds):
+            new_groups = []
+            for center in found:
+                for group in groups:
+                    mx, my, mradius = group[len(group) // 2]
+                    distance = math.hypot(mx - center[0], my - center[1])
+                    if distance < params.minDistBetweenBlobs or distance < mradius or distance < center[2]:
+                        # groups stay sorted by radius
+                        k = len(group)
+                        while k > 0 and center[2] < group[k - 1][2]:
+                            k -= 1
+                        group.insert(k, center)
+                        break
+                else:
+                    new_groups.append([center])
+            groups.extend(new_groups)
+
+        keypoints = []
+        for group in groups:
+            if len(group) < params.minRepeatability:
+                continue
+            cx = sum(center[0] for center in group) / len(group)
+            cy = sum(center[1] for center in group) / len(group)
+            keypoints.append(cv2.KeyPoint(cx, cy, 2 * group[len(group) // 2][2]))
+        return keypoints
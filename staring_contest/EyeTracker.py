@@ -0,0 +1,72 @@
+import cv2
+
+from preprocess import clamp_bounds, crop_channel
+
+
+class EyeTracker:
+    """Follows the eye region from frame to frame between face detections.
+
+    Face detections arrive a few times a second at best. anchor() takes the
+    eye region of a detection, and the next track() call saves that part of
+    the frame as a template. Every later track() looks for the template only
+    within `margin` pixels of where it was last found, which is a small
+    matchTemplate call, and returns the region's new bounds. When the best
+    match scores under min_score the eyes are taken as lost and track()
+    returns None until the next anchor().
+    """
+
+    def __init__(self, margin=12, min_score=0.5, channel=0):
+        self.margin = margin
+        self.min_score = min_score
+        self.channel = channel
+        self.score = None
+        self.lost = 0
+        self.__pending = None
+        self.__template = None
+        self.__position = None
+
+    @property
+    def tracking(self):
+        return self.__template is not None or self.__pending is not None
+
+    def anchor(self, bounds):
+        """Re-anchors on a detected (x1, y1, x2, y2) region, captured from the next frame."""
+        self.__pending = bounds
+
+    def track(self, image):
+        """Returns the tracked (x1, y1, x2, y2) region in this frame, or None when not tracking."""
+        if self.__pending is not None:
+            x1, y1, x2, y2 = clamp_bounds(self.__pending, *_size(image))
+            self.__pending = None
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                self.__template = None
+                return None
+            self.__template = crop_channel(image, (x1, y1, x2, y2), self.channel)
+            self.__position = (x1, y1)
+            self.score = 1.0
+            return x1, y1, x2, y2
+        if self.__template is None:
+            return None
+
+        h, w = self.__template.shape
+        x, y = self.__position
+        sx1, sy1, sx2, sy2 = clamp_bounds((x - self.margin, y - self.margin, x + w + self.margin,
+                                           y + h + self.margin), *_size(image))
+        search = crop_channel(image, (sx1, sy1, sx2, sy2), self.channel)
+        if search.shape[0] < h or search.shape[1] < w:
+            return None
+        scores = cv2.matchTemplate(search, self.__template, cv2.TM_CCOEFF_NORMED)
+        _, self.score, _, (mx, my) = cv2.minMaxLoc(scores)
+        if self.score < self.min_score:
+            self.__template = None
+            self.lost += 1
+            return None
+        self.__position = (sx1 + mx, sy1 + my)
+        return sx1 + mx, sy1 + my, sx1 + mx + w, sy1 + my + h
+
+
+def _size(image):
+    """The (width, height) of a PIL Image or numpy.ndarray."""
+    if hasattr(image, 'size') and not hasattr(image, 'shape'):
+        return image.size
+    return image.shape[1], image.shape[0]
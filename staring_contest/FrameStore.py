@@ -0,0 +1,156 @@
+import os
+import queue
+import threading
+import traceback
+
+import numpy
+
+INDEX = 'index.txt'
+
+
+class FrameStoreWriter:
+    """Appends grayscale frames to a directory of compressed chunks.
+
+    append() only queues the frame, so a capture loop keeps up with the
+    camera. A background thread packs the frames into (chunk_frames, H, W)
+    arrays and saves each full chunk with numpy.savez_compressed, along with
+    the frame timestamps, as chunk_NNNN.npz. Every saved chunk adds a line
+    "file first_frame frames first_time last_time" to index.txt, so the
+    store can be read back chunk by chunk in order. When the writer falls
+    more than max_queue frames behind, new frames are dropped and counted.
+    Every frame in a store has the size of its first frame, append()
+    raises ValueError for a frame of any other size. A chunk that fails to
+    save, say on a full disk, is thrown away and its frames are counted
+    under errors, while the thread carries on with the next chunk.
+    """
+
+    def __init__(self, directory, chunk_frames=256, max_queue=512):
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        self.frames = 0
+        self.chunks = 0
+        self.dropped = 0
+        self.errors = 0
+        self.shape = None
+        os.makedirs(directory, exist_ok=True)
+        # carry on after what is already in the directory
+        entries = read_index(directory)
+        for entry in entries:
+            self.chunks += 1
+            self.frames = entry[1] + entry[2]
+        if entries:
+            with numpy.load(os.path.join(directory, entries[0][0])) as chunk:
+                self.shape = chunk['frames'].shape[1:]
+        self._queue = queue.Queue(max_queue)
+        self._chunk = None
+        self._times = numpy.zeros(chunk_frames, dtype=numpy.float64)
+        self._count = 0
+        self._thread = threading.Thread(target=self._run, name='frame-store', daemon=True)
+        self._thread.start()
+
+    def append(self, frame, timestamp):
+        """Queues an (H, W) uint8 frame taken at timestamp. Returns False if it was dropped."""
+        if self.shape is None:
+            self.shape = frame.shape
+        elif frame.shape != self.shape:
+            raise ValueError("frame of size %s does not match the %s frames in '%s'" %
+                             (frame.shape, self.shape, self.directory))
+        try:
+            self._queue.put_nowait((frame, timestamp))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._save()
+                return
+            frame, timestamp = item
+            if self._chunk is None:
+                self._chunk = numpy.empty((self.chunk_frames,) + frame.shape, dtype=numpy.uint8)
+            self._chunk[self._count] = frame
+            self._times[self._count] = timestamp
+            self._count += 1
+            if self._count == self.chunk_frames:
+                self._save()
+
+    def _save(self):
+        try:
+            self._flush()
+        except Exception:
+            if not self.errors:
+                traceback.print_exc()
+            self.errors += self._count
+            self._count = 0
+
+    def _flush(self):
+        if not self._count:
+            return
+        name = 'chunk_%04i.npz' % self.chunks
+        path = os.path.join(self.directory, name)
+        # write to a temporary name first, so a chunk in the index is always complete
+        with open(path + '.tmp', 'wb') as f:
+            numpy.savez_compressed(f, frames=self._chunk[:self._count], times=self._times[:self._count])
+        os.replace(path + '.tmp', path)
+        with open(os.path.join(self.directory, INDEX), 'a') as f:
+            f.write("%s %i %i %.6f %.6f\n" % (name, self.frames, self._count, self._times[0],
+                                             self._times[self._count - 1]))
+        self.frames += self._count
+        self.chunks += 1
+        self._count = 0
+
+    def close(self):
+        """Writes out every queued frame, including a last partial chunk."""
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+
+
+def read_index(directory):
+    """Returns the (file, first_frame, frames, first_time, last_time) entries of a store, in order."""
+    path = os.path.join(directory, INDEX)
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path) as f:
+        for line in f:
+            name, first, count, first_time, last_time = line.split()
+            entries.append((name, int(first), int(count), float(first_time), float(last_time)))
+    return entries
+
+
+def is_frame_store(directory):
+    return os.path.exists(os.path.join(directory, INDEX))
+
+
+def read_frames(directory, limit=None):
+    """Reads a store back as (frames, times): an (N, H, W) uint8 stack and N timestamps.
+    With limit, stops after the chunks holding the first limit frames."""
+    entries = read_index(directory)
+    if limit is not None:
+        entries = [entry for entry in entries if entry[1] < limit]
+    total = sum(entry[2] for entry in entries)
+    frames = None
+    times = numpy.empty(total, dtype=numpy.float64)
+    for name, first, count, _, _ in entries:
+        with numpy.load(os.path.join(directory, name)) as chunk:
+            chunk_frames = chunk['frames']
+            if frames is None:
+                frames = numpy.empty((total,) + chunk_frames.shape[1:], dtype=numpy.uint8)
+            elif chunk_frames.shape[1:] != frames.shape[1:]:
+                raise ValueError("'%s' holds frames of size %s, the store started with %s" %
+                                 (os.path.join(directory, name), chunk_frames.shape[1:], frames.shape[1:]))
+            frames[first:first + count] = chunk_frames
+            times[first:first + count] = chunk['times']
+    if frames is None:
+        frames = numpy.empty((0, 0, 0), dtype=numpy.uint8)
+    if limit is not None:
+        return frames[:limit], times[:limit]
+    return frames, times
@@ -0,0 +1,334 @@
+import hashlib
+import os
+import pickle
+import re
+import xml.etree.ElementTree as ET
+
+import cv2
+import numpy
+
+from BlinkPipeline import BlurType, BlobBackend, create_blob_detector
+
+# bump when the plan format changes so stale cache files are ignored
+PLAN_VERSION = 2
+
+BLUR_TYPES = {'BOX': BlurType.Box_Blur, 'GAUSSIAN': BlurType.Gaussian_Blur,
+              'MEDIAN': BlurType.Median_Filter, 'BILATERAL': BlurType.Bilateral_Filter}
+
+
+class GripStep:
+    """One step of a .grip file: its GRIP operation name and input socket values."""
+
+    def __init__(self, index, name, values):
+        self.index = index
+        self.name = name
+        self.values = values
+        self.inputs = {}
+
+    @property
+    def output_name(self):
+        """The attribute GRIP's python generator would use for this step's output."""
+        return self.name.lower().replace(' ', '_') + '_output'
+
+    @property
+    def profile_name(self):
+        """The name the generated Pipeline times this step under, like CV_Threshold."""
+        return self.name.replace(' ', '_')
+
+
+def parse_grip(path):
+    """Parses a .grip file into a list of GripSteps, each with its
+    inputs wired to ('source', n) or ('step', n) per the file's connections."""
+    with open(path) as f:
+        text = f.read()
+    # GRIP writes a grip: prefix without ever declaring the namespace
+    root = ET.fromstring(re.sub(r'<(/?)grip:', r'<\1', text))
+
+    steps = []
+    for index, element in enumerate(root.find('steps')):
+        values = {}
+        for socket in element.findall('Input'):
+            value = socket.find('value')
+            if value is None:
+                continue
+            doubles = value.findall('double')
+            values[int(socket.get('socket'))] = [float(d.text) for d in doubles] if doubles else value.text
+        steps.append(GripStep(index, element.get('name'), values))
+
+    for connection in root.find('connections'):
+        output = connection.find('Output')
+        to = connection.find('Input')
+        if output.get('source') is not None:
+            origin = ('source', int(output.get('source')))
+        else:
+            origin = ('step', int(output.get('step')))
+        steps[int(to.get('step'))].inputs[int(to.get('socket'))] = origin
+    return steps
+
+
+def _ordered(steps):
+    """Returns the steps so that every step comes after the steps it reads from."""
+    ordered, done = [], set()
+
+    def visit(step):
+        if step.index in done:
+            return
+        for kind, index in step.inputs.values():
+            if kind == 'step':
+                visit(steps[index])
+        done.add(step.index)
+        ordered.append(step)
+
+    for step in steps:
+        visit(step)
+    return ordered
+
+
+def _operation(step):
+    """Translates a GripStep into a plan entry (operation, parameters)."""
+    v = step.values
+    if step.name == 'Desaturate':
+        return 'desaturate', ()
+    if step.name == 'Threshold Moving':
+        return 'threshold_moving', ()
+    if step.name == 'Blur':
+        return 'blur', (BLUR_TYPES[v[1]], float(v[2]))
+    if step.name == 'CV Threshold':
+        return 'cv_threshold', (float(v[1]), float(v[2]), getattr(cv2, v[3]))
+    if step.name == 'CV adaptiveThreshold':
+        return 'cv_adaptivethreshold', (float(v[1]), getattr(cv2, v[2]), getattr(cv2, v[3]), int(float(v[4]) + 0.5),
+                                        float(v[5]))
+    if step.name == 'Find Blobs':
+        return 'find_blobs', (float(v[1]), list(v[2]), v[3] == 'true')
+    raise ValueError("unsupported GRIP step '%s'" % step.name)
+
+
+# pairs of operations that run as one step on a shared buffer
+FUSIONS = {('desaturate', 'threshold_moving'): 'desaturate_moving',
+           ('blur', 'cv_threshold'): 'blur_threshold'}
+
+
+def compile_grip(path):
+    """Builds the execution plan for a .grip file.
+
+    Each plan entry is (operation, parameters, input slot, output names, step index,
+    step name). A step is fused with the next one when that step is its only
+    reader, and the fused entry is named after both, like Blur+CV_Threshold.
+    """
+    steps = _ordered(parse_grip(path))
+    readers = {}
+    for step in steps:
+        for origin in step.inputs.values():
+            readers[origin] = readers.get(origin, 0) + 1
+
+    plan = []
+    for step in steps:
+        operation, params = _operation(step)
+        origin = step.inputs.get(0)
+        if plan and origin == ('step', plan[-1][4]) and readers[origin] == 1 and \
+                (plan[-1][0], operation) in FUSIONS:
+            previous = plan.pop()
+            plan.append((FUSIONS[(previous[0], operation)], previous[1] + params, previous[2],
+                         previous[3] + (step.output_name,), step.index, previous[5] + '+' + step.profile_name))
+        else:
+            plan.append((operation, params, origin, (step.output_name,), step.index, step.profile_name))
+    return plan
+
+
+def load_plan(path, cache_dir=None):
+    """Returns compile_grip(path), reusing a cached plan when the file is unchanged."""
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '__pycache__')
+    cache_file = os.path.join(cache_dir, '%s.%s.plan' % (os.path.basename(path), digest[:16]))
+    try:
+        with open(cache_file, 'rb') as f:
+            version, plan = pickle.load(f)
+        if version == PLAN_VERSION:
+            return plan
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        pass
+
+    plan = compile_grip(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file, 'wb') as f:
+            pickle.dump((PLAN_VERSION, plan), f)
+    except OSError:
+        pass
+    return plan
+
+
+class CompiledPipeline:
+    """Runs a pipeline loaded from a .grip file.
+
+    Has the same interface as the generated Pipeline: set_source0, process,
+    process_batch, the set_find_blobs_* setters and one <step name>_output
+    attribute per step. Every step writes into buffers owned by the
+    pipeline, reallocated only when the source shape or type changes. The
+    outputs of steps fused into the next one share its buffer, so only the
+    last output of a fused pair is meaningful. An optional StageProfiler
+    times every plan entry under its GRIP step name, with fused steps
+    joined by '+'.
+    """
+
+    def __init__(self, plan, blob_backend=BlobBackend.Simple_Blob, profiler=None):
+        self.plan = plan
+        self.blob_backend = blob_backend
+        self.profiler = profiler
+        self.reallocations = 0
+        self.detector_builds = 0
+        self.__source0 = None
+        self.__buffers = {}
+        self.__buffers_shape = None
+        self.__detectors = {}
+        # Find Blobs parameters set after loading, by position in the step's params
+        self.__find_blobs_overrides = {}
+        self.__has_last = False
+        self.__parity = 0
+        for _, _, _, output_names, _, _ in plan:
+            for name in output_names:
+                setattr(self, name, None)
+
+    def set_source0(self, value):
+        assert isinstance(value, numpy.ndarray), "Source must be of type numpy.ndarray"
+        self.__source0 = value
+
+    def set_find_blobs_min_area(self, value):
+        """Sets the minimum blob area of every Find Blobs step."""
+        self.__find_blobs_overrides[0] = value
+
+    def set_find_blobs_circularity(self, value):
+        """Sets the [min, max] blob circularity of every Find Blobs step."""
+        self.__find_blobs_overrides[1] = list(value)
+
+    def set_find_blobs_dark_blobs(self, value):
+        """Sets whether every Find Blobs step looks for dark blobs."""
+        self.__find_blobs_overrides[2] = value
+
+    def set_find_blobs_backend(self, value):
+        """Selects the BlobBackend used by Find Blobs."""
+        self.blob_backend = value
+
+    def process(self):
+        source = self.__source0
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        shape = (source.shape, source.dtype)
+        if self.__buffers_shape != shape:
+            self.__buffers = {}
+            self.__buffers_shape = shape
+            self.__has_last = False
+            self.reallocations += 1
+
+        results = {}
+        for operation, params, origin, output_names, index, step_name in self.plan:
+            if origin is None or origin[0] == 'source':
+                input = source
+            else:
+                input = results[origin[1]]
+            output = getattr(self, '_CompiledPipeline__' + operation)(index, input, *params)
+            results[index] = output
+            for name in output_names:
+                setattr(self, name, output)
+            if profiler is not None:
+                profiler.mark(step_name)
+
+    def process_batch(self, frames):
+        """Runs the pipeline over an (N, H, W) stack of frames, one frame at a time.
+        Returns (blinks, blob_counts) like Pipeline.process_batch."""
+        assert isinstance(frames, numpy.ndarray) and frames.ndim == 3, "Frames must be an (N, H, W) numpy.ndarray"
+        blob_counts = numpy.zeros(len(frames), dtype=numpy.int32)
+        for i, frame in enumerate(frames):
+            self.set_source0(frame)
+            self.process()
+            blob_counts[i] = len(self.find_blobs_output)
+        return numpy.minimum(blob_counts, 1).astype(numpy.uint8), blob_counts
+
+    def __buffer(self, index, like, name='out', shape=None):
+        key = (index, name)
+        buffer = self.__buffers.get(key)
+        if buffer is None:
+            buffer = self.__buffers[key] = numpy.empty(shape or like.shape, dtype=like.dtype)
+        return buffer
+
+    def __desaturate(self, index, input, dst=None):
+        dst = self.__buffer(index, input, shape=input.shape[:2]) if dst is None else dst
+        if input.ndim == 2:
+            numpy.copyto(dst, input)
+        elif input.shape[2] == 3:
+            cv2.cvtColor(input, cv2.COLOR_BGR2GRAY, dst=dst)
+        else:
+            cv2.cvtColor(input, cv2.COLOR_BGRA2GRAY, dst=dst)
+        return dst
+
+    def __threshold_moving(self, index, input):
+        dst = self.__buffer(index, input)
+        last = self.__buffer(index, input, 'last')
+        if self.__has_last:
+            cv2.absdiff(input, last, dst=dst)
+        else:
+            dst.fill(0)
+        numpy.copyto(last, input)
+        self.__has_last = True
+        return dst
+
+    def __desaturate_moving(self, index, input):
+        # desaturate straight into one of two buffers that take turns holding
+        # the current and the previous frame, so nothing is copied
+        current = self.__buffer(index, input, 'gray%i' % self.__parity, input.shape[:2])
+        previous = self.__buffer(index, input, 'gray%i' % (1 - self.__parity), input.shape[:2])
+        self.__desaturate(index, input, current)
+        dst = self.__buffer(index, current)
+        if self.__has_last:
+            cv2.absdiff(current, previous, dst=dst)
+        else:
+            dst.fill(0)
+        self.__has_last = True
+        self.__parity = 1 - self.__parity
+        return dst
+
+    def __blur(self, index, input, blur_type, radius, dst=None):
+        dst = self.__buffer(index, input) if dst is None else dst
+        if blur_type is BlurType.Box_Blur:
+            ksize = int(2 * round(radius) + 1)
+            return cv2.blur(input, (ksize, ksize), dst=dst)
+        elif blur_type is BlurType.Gaussian_Blur:
+            ksize = int(6 * round(radius) + 1)
+            return cv2.GaussianBlur(input, (ksize, ksize), round(radius), dst=dst)
+        elif blur_type is BlurType.Median_Filter:
+            ksize = int(2 * round(radius) + 1)
+            return cv2.medianBlur(input, ksize, dst=dst)
+        return cv2.bilateralFilter(input, -1, round(radius), round(radius), dst=dst)
+
+    def __cv_threshold(self, index, input, thresh, max_val, threshold_type, dst=None):
+        dst = self.__buffer(index, input) if dst is None else dst
+        return cv2.threshold(input, thresh, max_val, threshold_type, dst=dst)[1]
+
+    def __blur_threshold(self, index, input, blur_type, radius, thresh, max_val, threshold_type):
+        blurred = self.__blur(index, input, blur_type, radius)
+        # threshold in place on the blur buffer
+        return self.__cv_threshold(index, blurred, thresh, max_val, threshold_type, blurred)
+
+    def __cv_adaptivethreshold(self, index, input, max_value, method, threshold_type, block_size, c):
+        return cv2.adaptiveThreshold(input, max_value, method, threshold_type, block_size, c,
+                                     dst=self.__buffer(index, input))
+
+    def __find_blobs(self, index, input, min_area, circularity, dark_blobs):
+        settings = [min_area, circularity, dark_blobs]
+        for position, value in self.__find_blobs_overrides.items():
+            settings[position] = value
+        settings.append(self.blob_backend)
+        # rebuild the detector only when a setter actually changed something
+        built = self.__detectors.get(index)
+        if built is None or built[0] != settings:
+            built = self.__detectors[index] = (settings, create_blob_detector(*settings))
+            self.detector_builds += 1
+        return built[1].detect(input)
+
+
+def load_pipeline(path, blob_backend=BlobBackend.Simple_Blob, profiler=None):
+    """Loads a .grip file into a ready to run CompiledPipeline."""
+    return CompiledPipeline(load_plan(path), blob_backend, profiler)
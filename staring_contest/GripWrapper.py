@@ -1,13 +1,41 @@
 from BlinkPipeline import Pipeline
+from GripLoader import load_pipeline
+from StageProfiler import StageProfiler
 
 
 class GripWrapper:
 
-    def __init__(self):
-        self.pipeline = Pipeline()
+    def __init__(self, preallocate=False, grip_file=None, profile=False):
+        """With preallocate, the generated BlinkPipeline reuses its step buffers, see run.
+        With grip_file, runs that .grip file instead of the generated BlinkPipeline.
+        With profile, times every pipeline step, see profile_stats."""
+        profiler = StageProfiler() if profile else None
+        if grip_file:
+            self.pipeline = load_pipeline(grip_file, profiler=profiler)
+        else:
+            self.pipeline = Pipeline(preallocate, profiler=profiler)
 
     def run(self, source):
+        """Returns (adaptive threshold image, blink flag) for one frame.
+        With preallocate or a grip_file the image is a pipeline buffer that the
+        next run overwrites, copy it to keep it."""
         self.pipeline.set_source0(source)
         self.pipeline.process()
         return (self.pipeline.cv_adaptivethreshold_output, min(1, len(self.pipeline.find_blobs_output)))
 
+    def run_batch(self, frames):
+        """Runs an (N, H, W) stack of frames, returning arrays of blink flags and blob counts."""
+        return self.pipeline.process_batch(frames)
+
+    def set_profiling(self, enabled, window=300):
+        """Turns step timing on or off. Turning it on starts from empty stats."""
+        self.pipeline.profiler = StageProfiler(window) if enabled else None
+
+    def profile_stats(self):
+        """Returns the rolling per-step stats from StageProfiler.stats, or {} when not profiling."""
+        profiler = self.pipeline.profiler
+        return profiler.stats() if profiler is not None else {}
+
+    def profile_report(self):
+        profiler = self.pipeline.profiler
+        return profiler.report() if profiler is not None else "profiling is off"
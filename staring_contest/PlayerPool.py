@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from BlinkDetector import BlinkDetector
+from EyeTracker import EyeTracker
+from GripWrapper import GripWrapper
+from preprocess import RoiNormalizer
+
+
+class Player:
+    """Everything tracked for one face: its eye ROI, pipeline and blink detector.
+
+    The pipeline and the blink detector keep state from frame to frame, so
+    a player's frames are only ever processed one at a time, in order.
+    """
+
+    def __init__(self, face_id, size=(128, 32)):
+        self.face_id = face_id
+        self.roi_normalizer = RoiNormalizer(size)
+        self.eye_tracker = EyeTracker()
+        # only the blink flag is kept, so the pipeline can reuse its buffers
+        self.pipeline = GripWrapper(preallocate=True)
+        self.blink_detector = BlinkDetector()
+        # the ROI in camera pixels, for drawing
+        self.window = None
+        self.last_seen = time.monotonic()
+        self.processed = 0
+        self.skipped = 0
+        self.queue_delays = deque(maxlen=300)
+        self._detection = None
+        self._slot = None
+        self._running = False
+
+    def process(self, frame, frame_time, detection=None):
+        """Runs one camera frame, returns (blink, BlinkEvent or None), or None without an ROI."""
+        h, w = frame.shape[:2]
+        if detection is not None:
+            self.roi_normalizer.update(detection)
+            self.eye_tracker.anchor(self.roi_normalizer.window(w, h))
+        tracked = self.eye_tracker.track(frame)
+        if tracked is not None:
+            self.roi_normalizer.update(tracked)
+        if not self.roi_normalizer.has_roi:
+            return None
+        self.window = self.roi_normalizer.window(w, h)
+        _, blink = self.pipeline.run(self.roi_normalizer(frame))
+        return blink, self.blink_detector.update(blink, frame_time)
+
+
+class PlayerPool:
+    """Tracks blinks for every face in view on a bounded pool of threads.
+
+    Each face id gets its own Player. submit() hands a camera frame to
+    every player: a player that is idle starts on it in the pool, and a
+    busy one keeps only the newest frame for when it is done, counting the
+    one it replaces as skipped. Different players run in parallel, and as
+    OpenCV releases the GIL, throughput grows with the number of workers
+    until every core is busy. Results are posted to `loop` with
+    call_soon_threadsafe as on_result(face_id, blink, event, frame_time),
+    or called on the pool thread when there is no loop. A face that has
+    not been observed for idle_timeout seconds is dropped.
+    """
+
+    def __init__(self, on_result, loop=None, workers=None, idle_timeout=5.0, size=(128, 32)):
+        self.on_result = on_result
+        self.loop = loop
+        self.idle_timeout = idle_timeout
+        self.size = size
+        self.players = {}
+        self.evicted = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        # one thread per core, more can't run the pipeline any faster
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+    def observe_face(self, face_id, bounds):
+        """Records a face detection's (x1, y1, x2, y2) eye region, adding a player for a new face."""
+        with self._lock:
+            player = self.players.get(face_id)
+            if player is None:
+                player = self.players[face_id] = Player(face_id, self.size)
+            player.last_seen = time.monotonic()
+            player._detection = bounds
+
+    def submit(self, image, frame_time=None):
+        """Hands a camera frame (PIL Image or numpy.ndarray) to every player."""
+        # one read only array that all the pool threads can share
+        frame = numpy.asarray(image)
+        now = time.monotonic()
+        with self._lock:
+            if self._closed:
+                return
+            for face_id in [face_id for face_id, player in self.players.items()
+                            if now - player.last_seen > self.idle_timeout]:
+                del self.players[face_id]
+                self.evicted += 1
+            for player in self.players.values():
+                if player._slot is not None:
+                    player.skipped += 1
+                player._slot = (frame, frame_time, now)
+                if not player._running:
+                    player._running = True
+                    self._executor.submit(self._run, player)
+
+    def _run(self, player):
+        # keeps going while frames arrive faster than the player gets through them
+        while True:
+            with self._lock:
+                if player._slot is None or self._closed:
+                    player._running = False
+                    return
+                frame, frame_time, submitted = player._slot
+                detection = player._detection
+                player._slot = None
+                player._detection = None
+            player.queue_delays.append(time.monotonic() - submitted)
+            try:
+                result = player.process(frame, frame_time, detection)
+            except Exception:
+                traceback.print_exc()
+                continue
+            player.processed += 1
+            if result is None:
+                continue
+            if self.loop is None:
+                self.on_result(player.face_id, result[0], result[1], frame_time)
+            elif not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.on_result, player.face_id, result[0], result[1], frame_time)
+
+    def stats(self):
+        with self._lock:
+            players = list(self.players.values())
+        # list() copies each deque in one go, while pool threads may be appending to it
+        delays = numpy.array(sum([list(player.queue_delays) for player in players], [])) * 1000
+        return {'players': len(players),
+                'evicted': self.evicted,
+                'processed': sum(player.processed for player in players),
+                'skipped': sum(player.skipped for player in players),
+                'queue_delay_ms_mean': float(delays.mean()) if len(delays) else None}
+
+    def close(self):
+        """Stops the pool after the frames already being processed."""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
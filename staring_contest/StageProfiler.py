@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict, deque
+
+import numpy
+
+
+class StageProfiler:
+    """Rolling per-step timings of a pipeline run.
+
+    The pipeline calls start() before its first step and mark(step) after
+    each step, which records the time since the previous call on the
+    monotonic perf_counter clock. Only the last `window` runs of each step
+    are kept. Pipelines hold None instead of a profiler when profiling is
+    off, so a disabled profiler costs one comparison per step.
+    """
+
+    def __init__(self, window=300):
+        self.window = window
+        self.samples = OrderedDict()
+        self.__last = None
+
+    def start(self):
+        self.__last = time.perf_counter()
+
+    def mark(self, step, frames=1):
+        """Records the time since start() or the last mark(). A step run on a
+        batch of frames is recorded as one sample per frame, of its average time."""
+        now = time.perf_counter()
+        seconds = (now - self.__last) / frames
+        for _ in range(frames):
+            self.record(step, seconds)
+        self.__last = now
+
+    def record(self, step, seconds):
+        samples = self.samples.get(step)
+        if samples is None:
+            samples = self.samples[step] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def reset(self):
+        self.samples.clear()
+
+    def stats(self):
+        """Returns {step: {count, mean_ms, p50_ms, p95_ms, max_ms, share}} over the window,
+        where share is the step's fraction of the summed mean step times."""
+        stats = OrderedDict()
+        for step, samples in self.samples.items():
+            ms = numpy.array(samples) * 1000
+            stats[step] = {'count': len(ms), 'mean_ms': float(ms.mean()),
+                           'p50_ms': float(numpy.percentile(ms, 50)), 'p95_ms': float(numpy.percentile(ms, 95)),
+                           'max_ms': float(ms.max())}
+        total = sum(step['mean_ms'] for step in stats.values())
+        for step in stats.values():
+            step['share'] = step['mean_ms'] / total if total else 0.0
+        return stats
+
+    def report(self):
+        """Returns stats() as a printable table."""
+        stats = self.stats()
+        width = max([22] + [len(step) for step in stats])
+        lines = ["%-*s %6s %8s %8s %8s %8s %6s" % (width, 'step', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'max ms',
+                                                   'share')]
+        for step, s in stats.items():
+            lines.append("%-*s %6i %8.3f %8.3f %8.3f %8.3f %5.1f%%" % (
+                width, step, s['count'], s['mean_ms'], s['p50_ms'], s['p95_ms'], s['max_ms'], 100 * s['share']))
+        return "\n".join(lines)
@@ -0,0 +1,48 @@
+#!python3
+"""Compares preprocess.crop_channel to the nested loop StaringContest used to crop and drop to one channel.
+
+    python bench_preprocess.py --repeat 200
+"""
+import argparse
+import timeit
+
+import numpy
+from PIL import Image
+
+from preprocess import crop_channel
+
+
+def loop_crop_channel(image, bounds):
+    """What StaringContest.new_image_handler did before crop_channel."""
+    cropped_image = image.crop(bounds)
+    roi = numpy.array(cropped_image, dtype=numpy.uint8)
+    new_roi = []
+    for row in roi:
+        new_col = []
+        for col in row:
+            new_col.append(col[0])
+        new_roi.append(new_col)
+    return numpy.array(new_roi)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = numpy.random.RandomState(0)
+    # a camera frame as the SDK delivers it
+    image = Image.fromarray(rng.randint(0, 255, (240, 320, 3)).astype(numpy.uint8))
+    array = numpy.array(image)
+
+    print("%-18s %12s %12s %12s %9s" % ('roi', 'loop us', 'pil us', 'ndarray us', 'speedup'))
+    for bounds in ((130, 100, 190, 130), (60, 80, 260, 150), (0, 0, 320, 240)):
+        expected = loop_crop_channel(image, bounds)
+        assert numpy.array_equal(crop_channel(image, bounds), expected)
+        assert numpy.array_equal(crop_channel(array, bounds), expected)
+
+        loop = timeit.timeit(lambda: loop_crop_channel(image, bounds), number=args.repeat) / args.repeat
+        pil = timeit.timeit(lambda: crop_channel(image, bounds), number=args.repeat) / args.repeat
+        ndarray = timeit.timeit(lambda: crop_channel(array, bounds), number=args.repeat) / args.repeat
+        print("%-18s %12.1f %12.1f %12.1f %8.0fx" % ('%ix%i' % (bounds[2] - bounds[0], bounds[3] - bounds[1]),
+                                                      loop * 1e6, pil * 1e6, ndarray * 1e6, loop / pil))
@@ -0,0 +1,140 @@
+#!python3
+"""Measures how well and how fast blink detection works on the labeled recording.
+
+    python benchmark.py --output before.json
+    python benchmark.py --grip-file blink_detection.grip --output after.json
+
+Runs GripWrapper over the frames from gather_test_data.py one at a time, as
+the game does, and turns its flags into blink events with BlinkDetector.
+Each run of frames labeled as blinks in labels.pkl is one true blink, and a
+detected blink counts as found when it starts within --tolerance frames of
+one. Reports event precision, recall and F1, the same for the per-frame
+flags, per-frame latency percentiles and frames per second, and writes
+them all as JSON to compare runs.
+"""
+import argparse
+import json
+import platform
+import time
+
+import cv2
+import numpy
+
+from BlinkDetector import BlinkDetector
+from GripWrapper import GripWrapper
+from dataset import load_labeled_frames
+
+
+def label_events(labels):
+    """Returns the (first, last) frame of every run of blink labels."""
+    events = []
+    start = None
+    for i, label in enumerate(labels):
+        if label and start is None:
+            start = i
+        elif not label and start is not None:
+            events.append((start, i - 1))
+            start = None
+    if start is not None:
+        events.append((start, len(labels) - 1))
+    return events
+
+
+def match_events(detected, expected, tolerance):
+    """Pairs each detected start frame with at most one expected (first, last) run.
+    Returns the number of pairs."""
+    matched = 0
+    used = set()
+    for frame in detected:
+        for k, (first, last) in enumerate(expected):
+            if k not in used and first - tolerance <= frame <= last + tolerance:
+                used.add(k)
+                matched += 1
+                break
+    return matched
+
+
+def scores(true_positives, detected, expected):
+    precision = true_positives / detected if detected else 0.0
+    recall = true_positives / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def percentile(values, q):
+    return float(numpy.percentile(values, q)) if len(values) else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default='data', help="directory of frames from gather_test_data.py")
+    parser.add_argument('--labels', default='labels.pkl', help="labels from label_test_data.py")
+    parser.add_argument('--grip-file', help="run this .grip file instead of the generated BlinkPipeline")
+    parser.add_argument('--fps', type=float, default=15, help="frame rate the recording was made at")
+    parser.add_argument('--tolerance', type=int, default=2, help="frames a detected blink may be off by")
+    parser.add_argument('--pre-open', type=int, default=2)
+    parser.add_argument('--min-closed', type=int, default=1)
+    parser.add_argument('--max-closed', type=int, default=1)
+    parser.add_argument('--post-open', type=int, default=2)
+    parser.add_argument('--warmup', type=int, default=5, help="untimed passes over the first frames")
+    parser.add_argument('--profile', action='store_true', help="also report per-step timings")
+    parser.add_argument('--output', default='benchmark.json', help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    frames, labels = load_labeled_frames(args.data, args.labels)
+    print("Loaded %i frames of %ix%i" % (len(frames), frames.shape[2], frames.shape[1]))
+
+    warmup = GripWrapper(preallocate=True, grip_file=args.grip_file)
+    for frame in frames[:args.warmup]:
+        warmup.run(frame)
+
+    wrapper = GripWrapper(preallocate=True, grip_file=args.grip_file, profile=args.profile)
+    detector = BlinkDetector(args.pre_open, args.min_closed, args.max_closed, args.post_open)
+    flags = numpy.zeros(len(frames), dtype=numpy.uint8)
+    latencies = numpy.zeros(len(frames))
+    detected = []
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        frame_start = time.perf_counter()
+        _, flags[i] = wrapper.run(frame)
+        latencies[i] = time.perf_counter() - frame_start
+        event = detector.update(flags[i], i / args.fps)
+        if event:
+            detected.append(int(round(event.time * args.fps)))
+    elapsed = time.perf_counter() - start
+
+    expected = label_events(labels)
+    true_frames = int(numpy.count_nonzero(flags & labels))
+    results = {
+        'frames': len(frames),
+        'frame_size': [int(frames.shape[2]), int(frames.shape[1])] if len(frames) else None,
+        'pipeline': args.grip_file or 'BlinkPipeline',
+        'opencv': cv2.__version__,
+        'python': platform.python_version(),
+        'pattern': {'pre_open': args.pre_open, 'min_closed': args.min_closed, 'max_closed': args.max_closed,
+                    'post_open': args.post_open, 'tolerance': args.tolerance},
+        'events': dict(scores(match_events(detected, expected, args.tolerance), len(detected), len(expected)),
+                       detected=len(detected), expected=len(expected)),
+        'frames_flagged': dict(scores(true_frames, int(numpy.count_nonzero(flags)), int(numpy.count_nonzero(labels))),
+                               flagged=int(numpy.count_nonzero(flags))),
+        'latency_ms': {'p%i' % q: percentile(latencies * 1000, q) for q in (50, 90, 99)},
+        'fps': len(frames) / elapsed if elapsed else None,
+    }
+    results['latency_ms']['max'] = float(latencies.max() * 1000) if len(latencies) else None
+    if args.profile:
+        results['steps'] = wrapper.profile_stats()
+
+    events = results['events']
+    print("blink events: %i detected, %i labeled  precision %.3f  recall %.3f  f1 %.3f" % (
+        events['detected'], events['expected'], events['precision'], events['recall'], events['f1']))
+    flagged = results['frames_flagged']
+    print("blink frames: precision %.3f  recall %.3f  f1 %.3f" % (
+        flagged['precision'], flagged['recall'], flagged['f1']))
+    latency = results['latency_ms']
+    print("latency ms p50/p90/p99/max: %.3f / %.3f / %.3f / %.3f  fps: %.1f" % (
+        latency['p50'], latency['p90'], latency['p99'], latency['max'], results['fps']))
+    if args.profile:
+        print(wrapper.profile_report())
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Wrote", args.output)
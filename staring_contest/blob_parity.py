@@ -0,0 +1,91 @@
+#!python3
+"""Checks that the connected-components blob backend finds the same blobs as SimpleBlobDetector.
+
+Runs both backends over binary images made from images/*.png (adaptive
+thresholds at several block sizes, both polarities, and the full pipeline
+run on pairs of frames). Also checks that Pipeline.process_batch counts
+the same blobs as process() frame by frame, including a batch that
+carries on from frames already streamed through process(). Exits non-zero
+on any mismatch.
+"""
+import glob
+import itertools
+import sys
+
+import cv2
+import numpy
+
+from BlinkPipeline import BlobBackend, Pipeline, create_blob_detector
+
+
+def binary_images():
+    images = [(f, cv2.imread(f, cv2.IMREAD_GRAYSCALE)) for f in sorted(glob.glob('images/*.png'))]
+    for (name, image), block_size, threshold_type in itertools.product(
+            images, (15, 31, 127), (cv2.THRESH_BINARY, cv2.THRESH_BINARY_INV)):
+        binary = cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, threshold_type, block_size, 0)
+        yield "%s block %i type %i" % (name, block_size, threshold_type), binary
+    for (name_a, image_a), (name_b, image_b) in itertools.permutations(images, 2):
+        pipeline = Pipeline()
+        for image in (image_a, image_b):
+            pipeline.set_source0(image)
+            pipeline.process()
+        yield "pipeline %s -> %s" % (name_a, name_b), pipeline.cv_adaptivethreshold_output
+
+
+def batch_mismatches(frames=40):
+    """Yields a description of every process_batch run that disagrees with process()."""
+    images = [cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in sorted(glob.glob('images/*.png'))]
+    sequence = numpy.stack([images[(i * 7 + i // 3) % len(images)] for i in range(frames)])
+    for preallocate in (False, True):
+        pipeline = Pipeline(preallocate)
+        expected = []
+        for frame in sequence:
+            pipeline.set_source0(frame)
+            pipeline.process()
+            expected.append(len(pipeline.find_blobs_output))
+        for streamed in (0, 10, frames - 1):
+            pipeline = Pipeline(preallocate)
+            actual = []
+            for frame in sequence[:streamed]:
+                pipeline.set_source0(frame)
+                pipeline.process()
+                actual.append(len(pipeline.find_blobs_output))
+            actual.extend(pipeline.process_batch(sequence[streamed:])[1].tolist())
+            if actual != expected:
+                yield "preallocate %s, batch after %i streamed frames: %s vs %s" % (
+                    preallocate, streamed, expected, actual)
+
+
+def detect(binary, backend, min_area):
+    return create_blob_detector(min_area, [0.0, 1.0], False, backend).detect(binary)
+
+
+def same(expected, actual, tolerance=0.5):
+    if len(expected) != len(actual):
+        return False
+    for keypoint in expected:
+        if not any(abs(keypoint.pt[0] - other.pt[0]) <= tolerance and abs(keypoint.pt[1] - other.pt[1]) <= tolerance
+                   and abs(keypoint.size - other.size) <= tolerance for other in actual):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    checked = 0
+    failures = 0
+    blobs = 0
+    for name, binary in binary_images():
+        for min_area in (10.0, 56.0):
+            expected = detect(binary, BlobBackend.Simple_Blob, min_area)
+            actual = detect(binary, BlobBackend.Connected_Components, min_area)
+            checked += 1
+            blobs += len(expected)
+            if not same(expected, actual):
+                failures += 1
+                print("MISMATCH %s min area %g: %s vs %s" % (
+                    name, min_area, [(k.pt, k.size) for k in expected], [(k.pt, k.size) for k in actual]))
+    for mismatch in batch_mismatches():
+        failures += 1
+        print("MISMATCH", mismatch)
+    print("%i cases, %i blobs, %i mismatches" % (checked, blobs, failures))
+    sys.exit(1 if failures else 0)
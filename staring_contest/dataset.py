@@ -0,0 +1,47 @@
+import os
+import pickle
+
+import cv2
+import numpy
+
+from FrameStore import is_frame_store, read_frames
+
+
+def load_labels(labels_file='labels.pkl'):
+    """Returns the blink labels written by label_test_data.py as an array of 0/1, one per frame."""
+    with open(labels_file, 'rb') as f:
+        labels = pickle.load(f)
+    return numpy.array([label == '1' for label in labels['data'][:labels['size']]], dtype=numpy.uint8)
+
+
+def load_frames(data_dir='data', limit=None):
+    """Returns an (N, H, W) uint8 stack of the frames written by gather_test_data.py.
+
+    Reads the chunked FrameStore if data_dir has one, otherwise the
+    data/frame_N.png files older recordings were saved as.
+    """
+    if not os.path.exists(data_dir):
+        raise FileNotFoundError("data directory '%s' does not exist" % data_dir)
+    if is_frame_store(data_dir):
+        return read_frames(data_dir, limit)[0]
+    frames = []
+    while limit is None or len(frames) < limit:
+        filename = os.path.join(data_dir, 'frame_' + str(len(frames)) + '.png')
+        if not os.path.exists(filename):
+            break
+        frames.append(cv2.imread(filename, cv2.IMREAD_GRAYSCALE))
+    if not frames:
+        return numpy.empty((0, 0, 0), dtype=numpy.uint8)
+    return numpy.stack(frames)
+
+
+def load_labeled_frames(data_dir='data', labels_file='labels.pkl'):
+    """Returns (frames, labels) for every labeled frame written by gather_test_data.py.
+
+    frames is an (N, H, W) uint8 stack, ready for Pipeline.process_batch.
+    """
+    labels = load_labels(labels_file)
+    frames = load_frames(data_dir, len(labels))
+    if len(frames) < len(labels):
+        raise FileNotFoundError("only %i of the %i labeled frames are in '%s'" % (len(frames), len(labels), data_dir))
+    return frames, labels
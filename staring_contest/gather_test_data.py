@@ -1,20 +1,27 @@
 #!python3
 import cv2
-import os
-import tensorflow as tf
+import time
+
+from FrameStore import FrameStoreWriter
 
 if __name__ == "__main__":
     cap = cv2.VideoCapture(0)
 
-    # setup test/train data directory
-    if not os.path.exists('data'):
-        os.mkdir('data')
-
-    for i in range(1000):
-        ret, frame = cap.read()
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        cv2.imwrite('data/frame_' + str(i) + '.png', gray)
+    # frames are packed into compressed chunks in data/ by a background thread,
+    # so the capture loop never waits on the disk
+    writer = FrameStoreWriter('data')
 
-    # When everything done, release the capture
-    cap.release()
-    cv2.destroyAllWindows()
+    try:
+        for i in range(1000):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            writer.append(gray, time.time())
+    finally:
+        # When everything done, release the capture
+        cap.release()
+        writer.close()
+        cv2.destroyAllWindows()
+    print("Wrote %i frames in %i chunks, dropped %i, lost %i to write errors" % (
+        writer.frames, writer.chunks, writer.dropped, writer.errors))
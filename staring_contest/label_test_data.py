@@ -5,16 +5,18 @@ import sys
 import cv2
 import pickle
 
+from dataset import load_frames
+
 if __name__ == "__main__":
     if not os.path.exists('data'):
         sys.exit("data directory does not exist")
 
+    frames = load_frames('data')
     blink_dir = {'size': 0, 'data': []}
     last_response = ''
-    for i in range(1000):
-        filename = 'data/frame_' + str(i) + '.png'
-        print(filename)
-        data = cv2.imread(filename)
+    for i in range(len(frames)):
+        print('frame %i' % i)
+        data = frames[i]
         cv2.imshow('data', data)
         cv2.waitKey(2)
         is_blink = input('?: ')
@@ -0,0 +1,123 @@
+import numpy
+from PIL import Image
+
+# channel=GRAY converts to luminance instead of taking a single channel
+GRAY = None
+
+
+def clamp_bounds(bounds, width, height):
+    """Clips (x1, y1, x2, y2) to a width x height image, as integers."""
+    x1, y1, x2, y2 = (int(round(v)) for v in bounds)
+    x1 = min(max(x1, 0), width)
+    y1 = min(max(y1, 0), height)
+    return x1, y1, min(max(x2, x1), width), min(max(y2, y1), height)
+
+
+def crop_channel(image, bounds, channel=0, out=None):
+    """Returns the (x1, y1, x2, y2) region of a camera image as a contiguous (H, W) uint8 array.
+
+    Args:
+        image: A PIL Image or an (H, W, C) / (H, W) numpy.ndarray.
+        bounds: The region in image pixels, clipped to the image.
+        channel: The channel to keep. 0 matches what StaringContest always fed
+            the pipeline; GRAY converts to luminance.
+        out: Optional (H, W) uint8 array to copy the result into.
+    Returns:
+        out if given. Otherwise a new array, read only when image is a PIL Image.
+    """
+    if isinstance(image, Image.Image):
+        bounds = clamp_bounds(bounds, image.width, image.height)
+        # crop before splitting so only the region is touched
+        region = image.crop(bounds)
+        if region.mode != 'L':
+            region = region.convert('L') if channel is GRAY else region.getchannel(channel)
+        result = numpy.asarray(region)
+    else:
+        x1, y1, x2, y2 = clamp_bounds(bounds, image.shape[1], image.shape[0])
+        region = image[y1:y2, x1:x2]
+        if region.ndim == 3:
+            if channel is GRAY:
+                region = numpy.asarray(Image.fromarray(numpy.ascontiguousarray(region)).convert('L'))
+            else:
+                region = region[:, :, channel]
+        result = numpy.ascontiguousarray(region, dtype=numpy.uint8)
+    if out is None:
+        return result
+    numpy.copyto(out, result)
+    return out
+
+
+class RoiNormalizer:
+    """Resamples a moving eye ROI to one fixed size.
+
+    Every face detection gives a slightly different eye region. Fed to the
+    pipeline as is, each change of size breaks its frame differencing and
+    reallocates its buffers. update() smooths the detected region with an
+    exponential moving average of its center and width, and __call__
+    resamples the smoothed region of each camera frame to `size`, keeping
+    size's aspect ratio so the eyes are scaled but never stretched.
+    """
+
+    def __init__(self, size=(128, 32), smoothing=0.3, channel=0):
+        """
+        Args:
+            size: The (width, height) the pipeline sees.
+            smoothing: The weight of each new detection, from 0 (ignore it) to 1 (no smoothing).
+            channel: The channel to keep, or GRAY, as for crop_channel.
+        """
+        self.size = size
+        self.smoothing = smoothing
+        self.channel = channel
+        self.center = None
+        self.width = None
+
+    @property
+    def has_roi(self):
+        return self.center is not None
+
+    def reset(self):
+        self.center = None
+        self.width = None
+
+    def update(self, bounds):
+        """Folds a detected (x1, y1, x2, y2) region into the smoothed one."""
+        x1, y1, x2, y2 = bounds
+        center = ((x1 + x2) / 2.0, (y1 + y2) / 2.0)
+        # widen to fit the detected height at the canonical aspect ratio
+        width = max(x2 - x1, (y2 - y1) * self.size[0] / self.size[1], 1.0)
+        if self.center is None:
+            self.center, self.width = center, width
+        else:
+            a = self.smoothing
+            self.center = (self.center[0] + a * (center[0] - self.center[0]),
+                           self.center[1] + a * (center[1] - self.center[1]))
+            self.width += a * (width - self.width)
+
+    @property
+    def bounds(self):
+        """The smoothed region as float (x1, y1, x2, y2), or None before the first update."""
+        if self.center is None:
+            return None
+        half_w = self.width / 2.0
+        half_h = half_w * self.size[1] / self.size[0]
+        return (self.center[0] - half_w, self.center[1] - half_h, self.center[0] + half_w, self.center[1] + half_h)
+
+    def window(self, width, height):
+        """The smoothed region moved, and if need be shrunk, to lie inside a width x height image."""
+        x1, y1, x2, y2 = self.bounds
+        scale = min(1.0, width / (x2 - x1), height / (y2 - y1))
+        w, h = (x2 - x1) * scale, (y2 - y1) * scale
+        cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        x1 = min(max(cx - w / 2.0, 0.0), width - w)
+        y1 = min(max(cy - h / 2.0, 0.0), height - h)
+        return x1, y1, x1 + w, y1 + h
+
+    def __call__(self, image):
+        """Returns the smoothed region of a camera frame as a (height, width) uint8 array of the canonical size."""
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(image)
+        # crops and resamples in one pass, at subpixel precision
+        region = image.resize(self.size, Image.BILINEAR, box=self.window(image.width, image.height))
+        if region.mode != 'L':
+            region = region.convert('L') if self.channel is GRAY else region.getchannel(self.channel)
+        return numpy.asarray(region)
@@ -3,10 +3,11 @@ import sys
 import cozmo
 from cozmo.util import degrees
 import asyncio
+import time
 import numpy
 import cv2
 from PIL import ImageColor
-from GripWrapper import GripWrapper
+from PlayerPool import PlayerPool
 
 
 class Pt():
@@ -25,13 +26,13 @@ class Pt():
 class StaringContest(cozmo.annotate.Annotator):
 
     def __init__(self):
-        self.eye_region_of_interest = [Pt(0, 0), Pt(320, 240)]
-        self.blob_history = []
         self.enabled = True
         self.eye_padding = 10
-        self.has_roi = False
-        self.pipeline = GripWrapper()
-        self.blinks = 0
+        # one player per face, each with its own eye ROI, pipeline and blink detector.
+        # started in run(), once there is an event loop to post results to
+        self.players = None
+        # face id -> blinks
+        self.blinks = {}
         self.pipeline_completions = 0
         self.w = 320
         self.h = 240
@@ -40,62 +41,49 @@ class StaringContest(cozmo.annotate.Annotator):
         self.done = False
 
     def new_image_handler(self, evt, obj=None, tap_count=None, **kwargs):
-        if self.has_roi:
-            bounds = (self.eye_region_of_interest[0].x, self.eye_region_of_interest[0].y,
-                      self.eye_region_of_interest[1].x, self.eye_region_of_interest[1].y)
-            cropped_image = evt.image.crop(bounds)
-            roi = numpy.array(cropped_image, dtype=numpy.uint8)
-            # go from 3 channel image to 1 channel
-            new_roi = []
-            for row in roi:
-                new_col = []
-                for col in row:
-                    new_col.append(col[0])
-                new_roi.append(new_col)
-            roi = numpy.array(new_roi)
-
-            # GRIP time!!!!
-            (output_image, blink) = self.pipeline.run(roi)
-            self.blob_history.append(blink)
-
-            # limited blob history
-            if len(self.blob_history) > 5:
-                self.blob_history = self.blob_history[1:]
-
-            if self.blob_history == [0, 0, 1, 0, 0]:
-                print("BLINK! %i" % self.blinks)
-                self.blinks += 1
-
-            # go from 1 channel image to 3 channel
-            # new_output_image = []
-            # for row in output_image:
-            #     new_col = []
-            #     for col in row:
-            #         new_col.append([col, col, col]) # 3 channel
-            #     new_output_image.append(new_col)
-            # output_image = numpy.array(new_output_image)
-            # padd_h = self.h - output_image.shape[0]
-            # padd_w = self.w - output_image.shape[1]
-            # padding = ((0, padd_h), (0, padd_w), (0, 0))
-            # padded_output_image = numpy.pad(output_image, padding, 'constant')
-
-            # for debugging, write to video
-            # self.video_writer.write(padded_output_image)
-            # self.pipeline_completions += 1
-
-            # filter out the blobs
+        if self.players.players:
+            # GRIP time!!!! for every face on the pool threads, so SDK events don't wait on it
+            self.players.submit(evt.image, time.time())
+
+    def pipeline_result_handler(self, face_id, blink, event, frame_time):
+        # called on the event loop by the pool with each pipeline result
+        if event:
+            blinks = self.blinks.get(face_id, 0)
+            print("BLINK! face %i: %i" % (face_id, blinks))
+            self.blinks[face_id] = blinks + 1
+
+        # go from 1 channel image to 3 channel
+        # new_output_image = []
+        # for row in output_image:
+        #     new_col = []
+        #     for col in row:
+        #         new_col.append([col, col, col]) # 3 channel
+        #     new_output_image.append(new_col)
+        # output_image = numpy.array(new_output_image)
+        # padd_h = self.h - output_image.shape[0]
+        # padd_w = self.w - output_image.shape[1]
+        # padding = ((0, padd_h), (0, padd_w), (0, 0))
+        # padded_output_image = numpy.pad(output_image, padding, 'constant')
+
+        # for debugging, write to video
+        # self.video_writer.write(padded_output_image)
+        # self.pipeline_completions += 1
+
+        # filter out the blobs
 
     @cozmo.event.filter_handler(cozmo.faces.EvtFaceObserved)
     def observed_face_handler(self, evt, obj=None, tap_count=None, **kwargs):
         # when we get a new face detection, save the area around the eyes
+        self.update_roi(evt.face)
 
-        if len(evt.face.left_eye) > 2 and len(evt.face.right_eye) > 2:
-            roi_x1 = round(max(evt.face.left_eye[0].x - self.eye_padding, 0))
-            roi_y1 = round(max(evt.face.left_eye[0].y - self.eye_padding, 0))
-            roi_x2 = round(min(evt.face.right_eye[2].x + self.eye_padding, 320))
-            roit_y2 = round(min(evt.face.right_eye[2].y + self.eye_padding, 240))
-            self.self.eye_region_of_interest = [Pt(roi_x1, roi_y1), Pt(roi_x2, roit_y2)]
-            self.has_roi = True
+    def update_roi(self, face):
+        if len(face.left_eye) > 2 and len(face.right_eye) > 2:
+            roi_x1 = max(face.left_eye[0].x - self.eye_padding, 0)
+            roi_y1 = max(face.left_eye[0].y - self.eye_padding, 0)
+            roi_x2 = min(face.right_eye[2].x + self.eye_padding, 320)
+            roi_y2 = min(face.right_eye[2].y + self.eye_padding, 240)
+            # the player smooths it and tracks the eyes from it until the next detection
+            self.players.observe_face(face.face_id, (roi_x1, roi_y1, roi_x2, roi_y2))
 
     async def run(self, sdk_conn: cozmo.conn.CozmoConnection):
         robot = await sdk_conn.wait_for_robot()
@@ -111,18 +99,13 @@ class StaringContest(cozmo.annotate.Annotator):
 
         robot.world.image_annotator.annotation_enabled = True
 
-        # robot.add_event_handler(cozmo.faces.EvtFaceObserved, self.observed_face_handler)
+        self.players = PlayerPool(self.pipeline_result_handler, asyncio.get_event_loop())
         evt = await robot.world.wait_for(cozmo.faces.EvtFaceObserved)
 
         # when we get a new face detection, save the area around the eyes
-
-        if len(evt.face.left_eye) > 2 and len(evt.face.right_eye) > 2:
-            roi_x1 = round(max(evt.face.left_eye[0].x - self.eye_padding, 0))
-            roi_y1 = round(max(evt.face.left_eye[0].y - self.eye_padding, 0))
-            roi_x2 = round(min(evt.face.right_eye[2].x + self.eye_padding, 320))
-            roit_y2 = round(min(evt.face.right_eye[2].y + self.eye_padding, 240))
-            self.eye_region_of_interest = [Pt(roi_x1, roi_y1), Pt(roi_x2, roit_y2)]
-            self.has_roi = True
+        self.update_roi(evt.face)
+        # and keep following the eyes of every face with every later detection
+        robot.add_event_handler(cozmo.faces.EvtFaceObserved, self.observed_face_handler)
 
         robot.camera.image_stream_enabled = True
         robot.camera.add_event_handler(cozmo.robot.camera.EvtNewRawCameraImage, self.new_image_handler)
@@ -130,15 +113,21 @@ class StaringContest(cozmo.annotate.Annotator):
 
         # infinite loop that doesn't hog CPU
         while True:
-            await asyncio.sleep(1)
+            await asyncio.sleep(10)
+            print("pipeline: %(players)i players, %(processed)i processed, %(skipped)i skipped, "
+                  "queue delay mean %(queue_delay_ms_mean)s ms" % self.players.stats())
+            for face_id, player in list(self.players.players.items()):
+                print("face %i blink rate: %.1f per minute" % (face_id, player.blink_detector.blink_rate(time.time())))
 
     def apply(self, image, scale):
         blue = ImageColor.getrgb("#f00")
-        roi = [Pt(scale * self.eye_region_of_interest[0].x, scale * self.eye_region_of_interest[0].y),
-               Pt(scale * self.eye_region_of_interest[1].x, scale * self.eye_region_of_interest[0].y),
-               Pt(scale * self.eye_region_of_interest[1].x, scale * self.eye_region_of_interest[1].y),
-               Pt(scale * self.eye_region_of_interest[0].x, scale * self.eye_region_of_interest[1].y)]
-        cozmo.annotate.add_polygon_to_image(image, roi, 1, blue)
+        for player in list(self.players.players.values()):
+            if player.window is None:
+                continue
+            x1, y1, x2, y2 = player.window
+            roi = [Pt(scale * x1, scale * y1), Pt(scale * x2, scale * y1),
+                   Pt(scale * x2, scale * y2), Pt(scale * x1, scale * y2)]
+            cozmo.annotate.add_polygon_to_image(image, roi, 1, blue)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+#!python3
+"""Tunes the blink pipeline parameters against the frames labeled with label_test_data.py.
+
+    python tune.py --workers 4
+    python tune.py --search random --samples 100 --blur-radius 2,4,6,8 --min-area 20,56,100 --output tune.json
+
+Every configuration runs the BlinkPipeline steps (Threshold Moving, Box
+Blur, CV Threshold, CV adaptiveThreshold, Find Blobs) over data/ and is
+scored on precision and recall of its per-frame blink flag (any blob
+found) against labels.pkl. The configurations form a tree, blur radius ->
+threshold -> block size -> min area, and each worker walks the whole
+subtree of one blur radius depth first, so every stage output is computed
+once and shared by all the configurations below it. The fps column is the
+single-core rate the full pipeline would run at with that configuration.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import time
+from collections import namedtuple
+
+import cv2
+import numpy
+
+from BlinkPipeline import BlobBackend, create_blob_detector
+from dataset import load_labeled_frames
+
+PARAMETERS = ('blur_radius', 'threshold', 'block_size', 'min_area')
+
+# the values currently in Pipeline.__init__ are 6, 12, 127 and 56
+DEFAULTS = {'blur_radius': [2, 4, 6, 8, 10, 13.5],
+            'threshold': [4, 8, 12, 16, 24],
+            'block_size': [31, 63, 127, 191],
+            'min_area': [20, 40, 56, 80, 120]}
+
+Result = namedtuple('Result', PARAMETERS + ('precision', 'recall', 'f1', 'fps'))
+
+# set in every worker by init_worker
+_diffs = None
+_labels = None
+_diff_seconds = 0.0
+_backend = None
+
+
+def frame_differences(frames):
+    """Step Threshold_Moving0 over a whole stack: every frame against the one before it."""
+    diffs = numpy.zeros_like(frames)
+    if len(frames) > 1:
+        w = frames.shape[2]
+        cv2.absdiff(frames[1:].reshape(-1, w), frames[:-1].reshape(-1, w), dst=diffs[1:].reshape(-1, w))
+    return diffs
+
+
+def init_worker(diffs, labels, diff_seconds, backend):
+    global _diffs, _labels, _diff_seconds, _backend
+    _diffs = diffs
+    _labels = labels
+    _diff_seconds = diff_seconds
+    _backend = backend
+
+
+def blurred(radius):
+    """Returns the box blurred difference stack and the seconds it took."""
+    start = time.perf_counter()
+    ksize = int(2 * round(radius) + 1)
+    stack = numpy.empty_like(_diffs)
+    for i in range(len(_diffs)):
+        cv2.blur(_diffs[i], (ksize, ksize), dst=stack[i])
+    return stack, time.perf_counter() - start
+
+
+def score(predicted, labels):
+    """Returns (precision, recall, f1) of the predicted blink flags."""
+    true_positives = int(numpy.count_nonzero(predicted & labels))
+    positives = int(numpy.count_nonzero(predicted))
+    actual = int(numpy.count_nonzero(labels))
+    precision = true_positives / positives if positives else 0.0
+    recall = true_positives / actual if actual else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def sweep_subtree(task):
+    """Scores every configuration under one blur radius, blurring the stack once.
+
+    task is (blur_radius, [(threshold, [(block_size, [min_area, ...]), ...]), ...]).
+    """
+    radius, thresholds = task
+    stack, blur_seconds = blurred(radius)
+    results = []
+    for threshold, branches in thresholds:
+        results.extend(sweep_threshold(stack, blur_seconds, radius, threshold, branches))
+    return results
+
+
+def sweep_threshold(stack, blur_seconds, radius, threshold, branches):
+    """Scores every configuration under one threshold of a blurred stack."""
+    n, h, w = stack.shape
+    start = time.perf_counter()
+    thresholded = numpy.empty_like(stack)
+    # a fixed threshold is per pixel, so the whole stack goes in one call
+    cv2.threshold(stack.reshape(-1, w), threshold, 255.0, cv2.THRESH_BINARY, dst=thresholded.reshape(-1, w))
+    threshold_seconds = time.perf_counter() - start
+
+    results = []
+    adaptive = numpy.empty((h, w), dtype=numpy.uint8)
+    for block_size, min_areas in branches:
+        detectors = [create_blob_detector(min_area, [0.0, 1.0], False, _backend) for min_area in min_areas]
+        predicted = numpy.zeros((len(min_areas), n), dtype=numpy.uint8)
+        adaptive_seconds = 0.0
+        blob_seconds = [0.0] * len(min_areas)
+        for i in range(n):
+            start = time.perf_counter()
+            cv2.adaptiveThreshold(thresholded[i], 255.0, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                  int(block_size), 0.0, dst=adaptive)
+            adaptive_seconds += time.perf_counter() - start
+            for j, detector in enumerate(detectors):
+                start = time.perf_counter()
+                predicted[j, i] = len(detector.detect(adaptive)) > 0
+                blob_seconds[j] += time.perf_counter() - start
+
+        for j, min_area in enumerate(min_areas):
+            seconds = _diff_seconds + blur_seconds + threshold_seconds + adaptive_seconds + blob_seconds[j]
+            results.append(Result(radius, threshold, block_size, min_area,
+                                  *score(predicted[j], _labels), fps=n / seconds if seconds else 0.0))
+    return results
+
+
+def configurations(grid, search, samples, seed):
+    configs = list(itertools.product(*[grid[name] for name in PARAMETERS]))
+    if search == 'random' and samples < len(configs):
+        configs = random.Random(seed).sample(configs, samples)
+    return configs
+
+
+def build_tasks(configs):
+    """Groups configurations into one task per blur radius subtree."""
+    tree = {}
+    for radius, threshold, block_size, min_area in configs:
+        tree.setdefault(radius, {}).setdefault(threshold, {}).setdefault(block_size, []).append(min_area)
+    return [(radius, [(threshold, sorted((block_size, sorted(min_areas)) for block_size, min_areas in blocks.items()))
+                      for threshold, blocks in sorted(thresholds.items())])
+            for radius, thresholds in sorted(tree.items())]
+
+
+def print_table(results, top):
+    print("%11s %9s %10s %8s %9s %6s %6s %7s" % (PARAMETERS + ('precision', 'recall', 'f1', 'fps')))
+    for result in results[:top]:
+        print("%11g %9g %10g %8g %9.3f %6.3f %6.3f %7.1f" % result)
+
+
+def parse_values(text):
+    return [float(value) for value in text.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default='data', help="directory of frames from gather_test_data.py")
+    parser.add_argument('--labels', default='labels.pkl', help="labels from label_test_data.py")
+    parser.add_argument('--search', choices=('grid', 'random'), default='grid')
+    parser.add_argument('--samples', type=int, default=100, help="configurations to try with --search random")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--backend', choices=('simple', 'components'), default='components',
+                        help="blob detector, both find the same blobs on binary images")
+    parser.add_argument('--top', type=int, default=20, help="rows of the table to print")
+    parser.add_argument('--output', help="write every result and the best configuration as JSON to this file")
+    for name in PARAMETERS:
+        parser.add_argument('--' + name.replace('_', '-'), type=parse_values,
+                            default=DEFAULTS[name], help="comma separated values to try")
+    args = parser.parse_args()
+
+    frames, labels = load_labeled_frames(args.data, args.labels)
+    print("Loaded %i frames, %i labeled as blinks" % (len(frames), numpy.count_nonzero(labels)))
+    start = time.perf_counter()
+    diffs = frame_differences(frames)
+    diff_seconds = time.perf_counter() - start
+    del frames
+
+    grid = {name: getattr(args, name) for name in PARAMETERS}
+    configs = configurations(grid, args.search, args.samples, args.seed)
+    tasks = build_tasks(configs)
+    backend = BlobBackend.Connected_Components if args.backend == 'components' else BlobBackend.Simple_Blob
+    print("Trying %i configurations under %i blur radii on %i workers" % (len(configs), len(tasks), args.workers))
+
+    start = time.perf_counter()
+    results = []
+    with multiprocessing.Pool(args.workers, init_worker, (diffs, labels, diff_seconds, backend)) as pool:
+        for subtree in pool.imap_unordered(sweep_subtree, tasks):
+            results.extend(subtree)
+    elapsed = time.perf_counter() - start
+    print("Swept in %.1f s (%.1f configurations/s)" % (elapsed, len(results) / elapsed))
+
+    results.sort(key=lambda result: (result.f1, result.fps), reverse=True)
+    print_table(results, args.top)
+    best = results[0]
+    print("Best: " + ", ".join("%s=%g" % (name, getattr(best, name)) for name in PARAMETERS) +
+          "  (precision %.3f, recall %.3f, f1 %.3f, %.1f fps)" % (best.precision, best.recall, best.f1, best.fps))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'best': best._asdict(), 'results': [result._asdict() for result in results]}, f, indent=2)
+        print("Wrote", args.output)
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import Counter, namedtuple
+from io import BytesIO
+
+from PIL import Image
+
+EncodedFrame = namedtuple('EncodedFrame', ['seq', 'jpeg', 'recv_time'])
+
+# scale is relative to the camera resolution, quality is the JPEG quality,
+# annotated variants have the overlays drawn on them
+Variant = namedtuple('Variant', ['scale', 'quality', 'annotated'])
+DEFAULT_VARIANT = Variant(1.0, 75, False)
+
+
+class FrameCache:
+    """Holds the newest camera frame and encodes it to JPEG at most once per variant.
+
+    Every viewer of a variant is handed the same encoded bytes, so the
+    number of encodes follows the camera frame rate instead of frames times
+    clients. Viewers subscribe() to the variant they watch; encodings of
+    variants nobody is subscribed to are evicted when the next frame arrives.
+
+    Annotated variants share a single copy of the frame with the overlays
+    drawn on it, rendered the first time any of them is encoded.
+    """
+
+    def __init__(self, metrics=None, overlays=None):
+        self.metrics = metrics
+        self.overlays = overlays
+        self.seq = 0
+        self.encode_count = 0
+        self.variants = Counter()
+        self._image = None
+        self._recv_time = None
+        self._encoded = {}
+        self._encode_locks = {}
+        self._annotated = None
+        self._annotate_lock = threading.Lock()
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def publish(self, pil_img, recv_time=None):
+        """Stores a new frame. Encoding is deferred until someone asks for it."""
+        if recv_time is None:
+            recv_time = time.time()
+        with self._lock:
+            self.seq += 1
+            self._image = pil_img
+            self._recv_time = recv_time
+            for variant in list(self._encode_locks):
+                if variant not in self.variants:
+                    self._encoded.pop(variant, None)
+                    del self._encode_locks[variant]
+            listeners = list(self._listeners)
+        if self.metrics:
+            self.metrics.fps.mark()
+            self.metrics.inc('frames_total')
+        for listener in listeners:
+            listener()
+
+    def add_listener(self, callback):
+        """Calls callback() from the publishing thread after every new frame."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            self._listeners.remove(callback)
+
+    def subscribe(self, variant=DEFAULT_VARIANT):
+        with self._lock:
+            self.variants[variant] += 1
+
+    def unsubscribe(self, variant=DEFAULT_VARIANT):
+        with self._lock:
+            self.variants[variant] -= 1
+            if self.variants[variant] <= 0:
+                del self.variants[variant]
+
+    def current(self):
+        """Returns (seq, recv_time) of the newest frame without encoding it."""
+        with self._lock:
+            return self.seq, self._recv_time
+
+    def cached(self, variant=DEFAULT_VARIANT):
+        """Returns the newest EncodedFrame only if it is already encoded."""
+        with self._lock:
+            frame = self._encoded.get(variant)
+            if frame is not None and frame.seq == self.seq:
+                return frame
+            return None
+
+    def latest(self, variant=DEFAULT_VARIANT):
+        """Returns the newest EncodedFrame, or None before the first frame."""
+        with self._lock:
+            encode_lock = self._encode_locks.setdefault(variant, threading.Lock())
+
+        with encode_lock:
+            with self._lock:
+                if self._image is None:
+                    return None
+                frame = self._encoded.get(variant)
+                if frame is not None and frame.seq == self.seq:
+                    return frame
+                seq, image, recv_time = self.seq, self._image, self._recv_time
+
+            if variant.annotated and self.overlays:
+                image = self._annotate(seq, image)
+
+            # encode outside of the frame lock so publish() never waits on it
+            start = time.perf_counter()
+            frame = EncodedFrame(seq, self._encode(image, variant), recv_time)
+            if self.metrics:
+                self.metrics.time('encode', start)
+
+            with self._lock:
+                self.encode_count += 1
+                self._encoded[variant] = frame
+                self._encode_locks.setdefault(variant, encode_lock)
+            return frame
+
+    def _annotate(self, seq, image):
+        with self._annotate_lock:
+            if self._annotated is None or self._annotated[0] != seq:
+                start = time.perf_counter()
+                self._annotated = (seq, self.overlays.render(image))
+                if self.metrics:
+                    self.metrics.time('overlay', start)
+            return self._annotated[1]
+
+    @staticmethod
+    def _encode(image, variant):
+        if variant.scale != 1.0:
+            size = (max(1, round(image.width * variant.scale)), max(1, round(image.height * variant.scale)))
+            image = image.resize(size, Image.BILINEAR)
+        tmp_file = BytesIO()
+        image.save(tmp_file, 'JPEG', quality=variant.quality)
+        return tmp_file.getvalue()
@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+"""Load test for the MJPEG stream server.
+
+    python loadtest.py run --clients 50 --slow 10 --duration 20 --output before.json
+    python loadtest.py serve --port 8090 [--replay PATH]
+
+`run` starts `serve` in a subprocess (or uses --connect HOST:PORT for a
+server that is already running), opens the requested number of viewers and
+reports delivered fps per viewer, end-to-end latency percentiles and the
+server's CPU and memory use. Run it before and after a change and compare
+the JSON files.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from frame_cache import FrameCache
+from metrics import Metrics
+from replay import ReplaySource
+from stream_server import StreamServer
+
+
+# what a slow viewer's socket and stream reader may hold
+SLOW_RECEIVE_BUFFER = 16 * 1024
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return float(np.percentile(values, q))
+
+
+def synthetic_frames(frame_cache, fps, width=320, height=240):
+    """Publishes moving noise so the JPEG encoder does realistic work."""
+    rng = np.random.RandomState(0)
+    noise = rng.randint(0, 255, (height, width * 2, 3)).astype(np.uint8)
+    i = 0
+    while True:
+        offset = i % width
+        frame_cache.publish(Image.fromarray(noise[:, offset:offset + width]))
+        i += 1
+        time.sleep(1.0 / fps)
+
+
+def serve(args):
+    metrics = Metrics()
+    metrics.add_process_gauges()
+    frame_cache = FrameCache(metrics)
+    server = StreamServer(frame_cache, args.host, args.port, metrics=metrics)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start())
+    if args.replay:
+        def _replay():
+            while True:
+                ReplaySource(args.replay).play(lambda evt: frame_cache.publish(evt.image.raw_image))
+        threading.Thread(target=_replay, daemon=True).start()
+    else:
+        threading.Thread(target=synthetic_frames, args=(frame_cache, args.fps), daemon=True).start()
+    loop.run_forever()
+
+
+class Viewer:
+    """One simulated MJPEG viewer. A slow viewer pauses after every frame.
+
+    A slow viewer also pins its socket receive buffer. Otherwise Linux
+    grows the buffer of a client that reads in bursts, and megabytes of
+    old frames queue up on the viewer side, where no server can skip them.
+    """
+
+    def __init__(self, host, port, path, pause=0.0):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.pause = pause
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+        self.error = None
+
+    async def run(self, duration):
+        if self.pause:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SLOW_RECEIVE_BUFFER)
+            sock.setblocking(False)
+            await asyncio.get_event_loop().sock_connect(sock, (socket.gethostbyname(self.host), self.port))
+            reader, writer = await asyncio.open_connection(sock=sock, limit=SLOW_RECEIVE_BUFFER)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (self.path, self.host)).encode())
+        deadline = time.time() + duration
+        try:
+            # response headers
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            while time.time() < deadline:
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), deadline - time.time())
+                    if line == b'':
+                        raise ConnectionError("server closed the stream")
+                    if line == b'\r\n' and headers:
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if value:
+                        headers[name.strip().lower()] = value.strip()
+                jpeg = await reader.readexactly(int(headers['content-length']))
+                self.frames += 1
+                self.bytes += len(jpeg)
+                if 'x-timestamp' in headers:
+                    self.latencies.append(time.time() - float(headers['x-timestamp']))
+                if self.pause:
+                    await asyncio.sleep(self.pause)
+        except asyncio.TimeoutError:
+            pass
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self.error = str(e)
+        finally:
+            writer.close()
+
+
+def scrape(host, port):
+    """Returns the server's /metrics as {name: value}, or {} if it has none."""
+    try:
+        with socket.create_connection((host, port), timeout=5) as sock:
+            sock.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            data = b''
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+    except OSError:
+        return {}
+    head, _, body = data.partition(b'\r\n\r\n')
+    if b' 200 ' not in head.split(b'\r\n')[0]:
+        return {}
+    values = {}
+    for line in body.decode().splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value)
+    return values
+
+
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start on %s:%i" % (host, port))
+
+
+def summarize(viewers, elapsed):
+    fps = [viewer.frames / elapsed for viewer in viewers]
+    latencies = [latency for viewer in viewers for latency in viewer.latencies]
+    return {'viewers': len(viewers),
+            'fps_min': min(fps) if fps else None,
+            'fps_median': percentile(fps, 50),
+            'fps_max': max(fps) if fps else None,
+            'latency_ms': {'p%i' % q: 1000 * percentile(latencies, q) if latencies else None
+                           for q in (50, 90, 99)}}
+
+
+def run(args):
+    server = None
+    if args.connect:
+        host, port = args.connect.rsplit(':', 1)
+        port = int(port)
+    else:
+        host, port = args.host, args.port
+        command = [sys.executable, os.path.abspath(__file__), 'serve', '--host', host, '--port', str(port),
+                   '--fps', str(args.fps)]
+        if args.replay:
+            command += ['--replay', args.replay]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(host, port)
+        time.sleep(args.warmup)
+        before = scrape(host, port)
+
+        viewers = [Viewer(host, port, args.path, args.slow_pause if i < args.slow else 0.0)
+                   for i in range(args.clients)]
+        loop = asyncio.get_event_loop()
+        start = time.time()
+        loop.run_until_complete(asyncio.gather(*[viewer.run(args.duration) for viewer in viewers]))
+        elapsed = time.time() - start
+        after = scrape(host, port)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    results = {
+        'clients': args.clients,
+        'duration': elapsed,
+        'fast': summarize([viewer for viewer in viewers if not viewer.pause], elapsed),
+        'slow': summarize([viewer for viewer in viewers if viewer.pause], elapsed),
+        'errors': sum(1 for viewer in viewers if viewer.error),
+        'per_client_fps': [viewer.frames / elapsed for viewer in viewers],
+    }
+    cpu = 'video_process_cpu_seconds'
+    if cpu in before and cpu in after:
+        results['server_cpu_percent'] = 100 * (after[cpu] - before[cpu]) / elapsed
+    if 'video_process_max_rss_bytes' in after:
+        results['server_max_rss_mb'] = after['video_process_max_rss_bytes'] / 1024 / 1024
+    if 'video_frames_total' in after:
+        results['server_fps'] = (after['video_frames_total'] - before.get('video_frames_total', 0)) / elapsed
+
+    for group in ('fast', 'slow'):
+        summary = results[group]
+        if summary['viewers']:
+            print("%-5s viewers: %3i  fps min/median/max: %.1f / %.1f / %.1f" % (
+                group, summary['viewers'], summary['fps_min'], summary['fps_median'], summary['fps_max']))
+            if summary['latency_ms']['p50'] is not None:
+                print("      latency ms p50/p90/p99: %.1f / %.1f / %.1f" % (
+                    summary['latency_ms']['p50'], summary['latency_ms']['p90'], summary['latency_ms']['p99']))
+    if 'server_cpu_percent' in results:
+        print("server cpu: %.1f%%  max rss: %.1f MB" % (results['server_cpu_percent'],
+                                                       results.get('server_max_rss_mb', 0)))
+    print("viewer errors:", results['errors'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Wrote", args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    serve_parser = subparsers.add_parser('serve', help="run a stream server with a synthetic or replayed source")
+    run_parser = subparsers.add_parser('run', help="load test a stream server")
+    for sub in (serve_parser, run_parser):
+        sub.add_argument('--host', default='localhost')
+        sub.add_argument('--port', type=int, default=8090)
+        sub.add_argument('--fps', type=float, default=15, help="synthetic source frame rate")
+        sub.add_argument('--replay', metavar='PATH', help="replay a recording instead of synthetic frames")
+
+    run_parser.add_argument('--connect', metavar='HOST:PORT', help="test an already running server")
+    run_parser.add_argument('--clients', type=int, default=20)
+    run_parser.add_argument('--slow', type=int, default=0, help="how many of the clients are slow")
+    run_parser.add_argument('--slow-pause', type=float, default=0.5, help="seconds a slow client waits per frame")
+    run_parser.add_argument('--duration', type=float, default=10)
+    run_parser.add_argument('--warmup', type=float, default=1)
+    run_parser.add_argument('--path', default='/cam.mjpg')
+    run_parser.add_argument('--output', help="write results as JSON to this file")
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+    else:
+        run(args)
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import deque
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, value) for key, value in labels) + '}'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+class Summary:
+    """Quantiles over the last `window` observations plus all-time sum and count."""
+
+    def __init__(self, window=1000):
+        self.values = deque(maxlen=window)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.values.append(value)
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        values = sorted(self.values)
+        if not values:
+            return float('nan')
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class RateMeter:
+    """Events per second over the last `window` seconds."""
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.times = deque()
+
+    def mark(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.times.append(now)
+        while self.times and self.times[0] < now - self.window:
+            self.times.popleft()
+
+    def rate(self):
+        now = time.monotonic()
+        while self.times and self.times[0] < now - self.window:
+            self.times.popleft()
+        return len(self.times) / self.window
+
+
+class Metrics:
+    """Frame pipeline timings and counters, rendered in the Prometheus text format.
+
+    Stage timings go into one rolling summary per stage (receive, convert,
+    encode, write, record). Gauges may be plain values or callables that are
+    read when the metrics are rendered.
+    """
+
+    def __init__(self, prefix='video', window=1000):
+        self.prefix = prefix
+        self.window = window
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.fps = RateMeter()
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            summary = self.stages.get(stage)
+            if summary is None:
+                summary = self.stages[stage] = Summary(self.window)
+            summary.observe(seconds)
+
+    def time(self, stage, start):
+        """Records the time since start, a time.perf_counter() value, under stage."""
+        self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def remove_gauge(self, name, **labels):
+        with self._lock:
+            self.gauges.pop((name, _label_key(labels)), None)
+
+    def add_process_gauges(self):
+        """Exports CPU time and peak resident memory of this process."""
+        self.set_gauge('process_cpu_seconds', time.process_time)
+        if resource:
+            # ru_maxrss is in kilobytes on Linux
+            self.set_gauge('process_max_rss_bytes', lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+    def render(self):
+        name = self.prefix + '_stage_seconds'
+        lines = ['# TYPE %s summary' % name]
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            for stage, summary in stages:
+                for q in QUANTILES:
+                    lines.append('%s{stage="%s",quantile="%g"} %.6g' % (name, stage, q, summary.quantile(q)))
+                lines.append('%s_sum{stage="%s"} %.6g' % (name, stage, summary.sum))
+                lines.append('%s_count{stage="%s"} %i' % (name, stage, summary.count))
+
+        lines.append('# TYPE %s_fps gauge' % self.prefix)
+        lines.append('%s_fps %.3f' % (self.prefix, self.fps.rate()))
+        typed = set()
+        for (counter, labels), value in counters:
+            if counter not in typed:
+                lines.append('# TYPE %s_%s counter' % (self.prefix, counter))
+                typed.add(counter)
+            lines.append('%s_%s%s %s' % (self.prefix, counter, _format_labels(labels), value))
+        for (gauge, labels), value in gauges:
+            if callable(value):
+                value = value()
+            if gauge not in typed:
+                lines.append('# TYPE %s_%s gauge' % (self.prefix, gauge))
+                typed.add(gauge)
+            lines.append('%s_%s%s %s' % (self.prefix, gauge, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,44 @@
+import threading
+import time
+from collections import namedtuple
+
+from PIL import ImageDraw
+
+Layer = namedtuple('Layer', ['items', 'color', 'expires'])
+
+
+class Overlays:
+    """Named layers of labeled boxes to draw over the camera stream.
+
+    Producers replace a layer whenever they have new detections, such as
+    the image boxes of the cubes video_server.py observes. FrameCache
+    calls render() at most once per frame for the annotated variant, so the
+    drawing cost does not depend on how many viewers watch it.
+    """
+
+    def __init__(self):
+        self.layers = {}
+        self._lock = threading.Lock()
+
+    def set_boxes(self, name, boxes, color='red', ttl=None, labels=None):
+        """boxes are (x1, y1, x2, y2) in camera pixels. The layer vanishes after ttl seconds."""
+        items = [(box, labels[i] if labels else None) for i, box in enumerate(boxes)]
+        with self._lock:
+            self.layers[name] = Layer(items, color, ttl and time.monotonic() + ttl)
+
+    def render(self, image):
+        """Returns a copy of image with every live layer drawn on it."""
+        now = time.monotonic()
+        with self._lock:
+            for name in [name for name, layer in self.layers.items() if layer.expires and layer.expires < now]:
+                del self.layers[name]
+            layers = [self.layers[name] for name in sorted(self.layers)]
+
+        image = image.copy()
+        draw = ImageDraw.Draw(image)
+        for layer in layers:
+            for box, label in layer.items:
+                draw.rectangle(box, outline=layer.color)
+                if label:
+                    draw.text((box[0] + 2, box[1] + 1), label, fill=layer.color)
+        return image
@@ -0,0 +1,115 @@
+import queue
+import threading
+import time
+import traceback
+
+import cv2
+import numpy as np
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+_STOP = object()
+
+
+class RecordingWriter:
+    """Records camera frames on a background thread fed by a bounded queue.
+
+    The sink is any object with write(bgr_frame, recv_time) and close(),
+    such as segments.SegmentedSink.
+
+    submit() is cheap and is meant to be called from the SDK event callback.
+    When the queue is full the policy decides what happens: BLOCK waits for
+    room, DROP_OLDEST throws away the oldest queued frame and DROP_NEWEST
+    throws away the frame being submitted.
+
+    A frame the sink fails to write, say on a full disk, is counted under
+    errors and the thread carries on with the next one, so the queue keeps
+    draining and neither submit() nor close() can wait on a dead writer.
+    The first failure is printed.
+    """
+
+    def __init__(self, sink, max_queue=30, policy=DROP_OLDEST, metrics=None):
+        if policy not in POLICIES:
+            raise ValueError("unknown drop policy %s" % policy)
+        self.sink = sink
+        self.policy = policy
+        self.metrics = metrics
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, pil_img, recv_time=None):
+        """Queues a frame for writing. Returns False if it was dropped."""
+        item = (pil_img, recv_time)
+        if self.policy == BLOCK:
+            self._queue.put(item)
+        elif self.policy == DROP_NEWEST:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._count('dropped')
+                return False
+        else:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self._count('dropped')
+                    except queue.Empty:
+                        pass
+        self._count('queued')
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self.queued, 'written': self.written, 'dropped': self.dropped,
+                    'errors': self.errors, 'pending': self._queue.qsize()}
+
+    def close(self):
+        """Writes out whatever is still queued, then closes the sink."""
+        while self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+        self.sink.close()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        if self.metrics:
+            self.metrics.inc('recording_frames_total', state=name)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            pil_img, recv_time = item
+            start = time.perf_counter()
+            try:
+                frame = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+                converted = time.perf_counter()
+                self.sink.write(frame, recv_time)
+            except Exception:
+                if not self.errors:
+                    traceback.print_exc()
+                self._count('errors')
+                continue
+            if self.metrics:
+                self.metrics.observe('convert', converted - start)
+                self.metrics.time('record', converted)
+            self._count('written')
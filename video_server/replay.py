@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+"""Replays recorded camera frames into SDK-style image handlers without a robot.
+
+Usage: python replay.py PATH [--speed 2] [--max-speed]
+
+PATH may be a video file, a frame directory written by
+staring_contest/gather_test_data.py (a FrameStore of chunk_NNNN.npz files
+listed in index.txt, or frame_N.png files from older recordings) or one
+segment of a recording made by video_server.py (e.g.
+videos/<stamp>_0000.mjpeg).
+"""
+import argparse
+import asyncio
+import glob
+import os
+import re
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from segments import RecordingReader
+
+
+class ReplayCameraImage:
+    """Stands in for cozmo.world.CameraImage."""
+
+    def __init__(self, raw_image, image_number, image_recv_time):
+        self.raw_image = raw_image
+        self.image_number = image_number
+        self.image_recv_time = image_recv_time
+
+
+class ReplayEvent:
+    """Stands in for EvtNewCameraImage, or EvtNewRawCameraImage when image is a PIL image."""
+
+    def __init__(self, image):
+        self.image = image
+
+
+def _frame_number(filename):
+    return int(re.search(r"(\d+)\D*$", filename).group(1))
+
+
+def _read_frame_store(path):
+    """Yields (recv_time, RGB PIL image) pairs from a staring_contest FrameStore, chunk by chunk."""
+    with open(os.path.join(path, 'index.txt')) as f:
+        names = [line.split()[0] for line in f if line.strip()]
+    for name in names:
+        with np.load(os.path.join(path, name)) as chunk:
+            frames, times = chunk['frames'], chunk['times']
+        for frame, recv_time in zip(frames, times):
+            yield float(recv_time), Image.fromarray(frame).convert('RGB')
+
+
+def read_frames(path, fps=15):
+    """Yields (recv_time, RGB PIL image) pairs from a recording.
+
+    Raises FileNotFoundError for a missing path and ValueError for a path
+    that can't be opened or holds no frames, rather than replaying nothing.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError("no recording at '%s'" % path)
+    found = False
+    for recv_time, image in _read_recording(path, fps):
+        found = True
+        yield recv_time, image
+    if not found:
+        raise ValueError("no frames found in '%s'" % path)
+
+
+def _read_recording(path, fps):
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, 'index.txt')):
+        yield from _read_frame_store(path)
+    elif os.path.isdir(path):
+        filenames = sorted(glob.glob(os.path.join(path, "frame_*.png")), key=_frame_number)
+        for i, filename in enumerate(filenames):
+            yield i / fps, Image.open(filename).convert('RGB')
+    elif path.endswith('.mjpeg'):
+        directory, name = os.path.split(path)
+        prefix = re.sub(r"_\d+\.mjpeg$", "", name)
+        for entry, frame in RecordingReader(directory or '.', prefix):
+            yield entry.recv_time, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    else:
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            capture.release()
+            raise ValueError("OpenCV can't open '%s' as a video" % path)
+        i = 0
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                recv_time = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                if recv_time <= 0 and i > 0:
+                    recv_time = i / fps
+                yield recv_time, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                i += 1
+        finally:
+            capture.release()
+
+
+class ReplaySource:
+    """Feeds recorded frames to camera event handlers.
+
+    speed scales the recorded frame timing (2.0 plays twice as fast); None
+    plays as fast as the handler allows. With raw=True events look like
+    EvtNewRawCameraImage (evt.image is the PIL image), otherwise like
+    EvtNewCameraImage. recv_time is rebased onto the current wall clock.
+    """
+
+    def __init__(self, path, speed=1.0, fps=15, raw=False):
+        self.path = path
+        self.speed = speed
+        self.fps = fps
+        self.raw = raw
+        self.frames = 0
+        self.elapsed = 0.0
+        self.handler_time = 0.0
+        self.max_handler_time = 0.0
+
+    def _events(self):
+        start_wall = None
+        for i, (recv_time, image) in enumerate(read_frames(self.path, self.fps)):
+            if start_wall is None:
+                start_wall, start_recv = time.time(), recv_time
+            due = start_wall
+            if self.speed:
+                due += (recv_time - start_recv) / self.speed
+            if self.raw:
+                yield due, ReplayEvent(image)
+            else:
+                yield due, ReplayEvent(ReplayCameraImage(image, i, due))
+
+    def _call(self, handler, evt):
+        start = time.perf_counter()
+        handler(evt)
+        spent = time.perf_counter() - start
+        self.frames += 1
+        self.handler_time += spent
+        self.max_handler_time = max(self.max_handler_time, spent)
+
+    def play(self, handler):
+        """Blocks until every frame has been handed to handler(evt)."""
+        start = time.perf_counter()
+        for due, evt in self._events():
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._call(handler, evt)
+        self.elapsed = time.perf_counter() - start
+        return self.stats()
+
+    async def play_async(self, handler):
+        """Like play(), but sleeps on the running event loop between frames."""
+        start = time.perf_counter()
+        for due, evt in self._events():
+            await asyncio.sleep(max(due - time.time(), 0))
+            self._call(handler, evt)
+        self.elapsed = time.perf_counter() - start
+        return self.stats()
+
+    def stats(self):
+        return {'frames': self.frames,
+                'seconds': self.elapsed,
+                'fps': self.frames / self.elapsed if self.elapsed else 0.0,
+                'mean_handler_ms': 1000 * self.handler_time / self.frames if self.frames else 0.0,
+                'max_handler_ms': 1000 * self.max_handler_time}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help="video file, frame directory or recording segment")
+    parser.add_argument('--speed', type=float, default=1.0, help="multiple of the recorded frame rate")
+    parser.add_argument('--max-speed', action="store_true", help="replay as fast as possible")
+    parser.add_argument('--fps', type=float, default=15, help="frame rate of frame directories")
+    args = parser.parse_args()
+
+    def convert(evt):
+        np.array(evt.image.raw_image)
+
+    source = ReplaySource(args.path, None if args.max_speed else args.speed, args.fps)
+    print(source.play(convert))
@@ -0,0 +1,132 @@
+import glob
+import os
+import re
+import time
+from bisect import bisect_right
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+IndexEntry = namedtuple('IndexEntry', ['frame', 'recv_time', 'segment', 'offset', 'length'])
+
+
+def segment_path(directory, prefix, number):
+    return os.path.join(directory, "%s_%04i.mjpeg" % (prefix, number))
+
+
+def index_path(segment_file):
+    return os.path.splitext(segment_file)[0] + ".idx"
+
+
+class SegmentedSink:
+    """Recording sink that writes JPEG frames into rotating segment files.
+
+    Each segment is a plain concatenation of JPEGs (playable with
+    `ffplay -f mjpeg`) with a sidecar .idx text file holding one line per
+    frame: frame number, receive time, byte offset and length. A new segment
+    is started once the current one reaches max_bytes or spans max_seconds.
+    """
+
+    def __init__(self, directory, prefix, max_bytes=64 * 1024 * 1024, max_seconds=300, quality=90):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.quality = quality
+        self.frame = 0
+        self.segment = -1
+        self._data = None
+        self._index = None
+        self._offset = 0
+        self._segment_start = None
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def write(self, frame, recv_time):
+        if recv_time is None:
+            recv_time = time.time()
+        ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return
+        if self._data is None or self._offset >= self.max_bytes or \
+                recv_time - self._segment_start >= self.max_seconds:
+            self._rotate(recv_time)
+        self._data.write(jpeg.tobytes())
+        self._index.write("%i %.6f %i %i\n" % (self.frame, recv_time, self._offset, len(jpeg)))
+        self._offset += len(jpeg)
+        self.frame += 1
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+            self._data = None
+            self._index = None
+
+    def _rotate(self, recv_time):
+        self.close()
+        self.segment += 1
+        filename = segment_path(self.directory, self.prefix, self.segment)
+        self._data = open(filename, 'wb')
+        # line buffered so the index never runs ahead of a crash
+        self._index = open(index_path(filename), 'w', buffering=1)
+        self._offset = 0
+        self._segment_start = recv_time
+
+
+class RecordingReader:
+    """Random access into a recording written by SegmentedSink.
+
+    The sidecar indexes are loaded once; seeking to a wall-clock time is a
+    binary search followed by a single read of that frame's JPEG.
+    """
+
+    def __init__(self, directory, prefix):
+        pattern = re.compile(re.escape(prefix) + r"_(\d+)\.mjpeg$")
+        segments = []
+        for filename in glob.glob(os.path.join(directory, glob.escape(prefix) + "_*.mjpeg")):
+            match = pattern.search(filename)
+            if match:
+                segments.append((int(match.group(1)), filename))
+        self.segments = [filename for _, filename in sorted(segments)]
+        self.entries = []
+        for segment, filename in enumerate(self.segments):
+            with open(index_path(filename)) as index:
+                for line in index:
+                    frame, recv_time, offset, length = line.split()
+                    self.entries.append(IndexEntry(int(frame), float(recv_time), segment, int(offset), int(length)))
+        self.times = [entry.recv_time for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for i in range(len(self.entries)):
+            yield self.read(i)
+
+    @property
+    def start_time(self):
+        return self.times[0] if self.times else None
+
+    @property
+    def end_time(self):
+        return self.times[-1] if self.times else None
+
+    def seek(self, recv_time):
+        """Returns the position of the last frame received at or before recv_time."""
+        return max(bisect_right(self.times, recv_time) - 1, 0)
+
+    def read_jpeg(self, i):
+        entry = self.entries[i]
+        with open(self.segments[entry.segment], 'rb') as data:
+            data.seek(entry.offset)
+            return entry, data.read(entry.length)
+
+    def read(self, i):
+        """Returns (IndexEntry, BGR image) for the frame at position i."""
+        entry, jpeg = self.read_jpeg(i)
+        return entry, cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def frame_at(self, recv_time):
+        return self.read(self.seek(recv_time))
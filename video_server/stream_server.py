@@ -0,0 +1,250 @@
+import asyncio
+import socket
+import time
+from email.utils import formatdate
+from urllib.parse import parse_qs, urlsplit
+
+from frame_cache import DEFAULT_VARIANT, Variant
+
+BOUNDARY = b'jpgboundary'
+
+# kernel send buffer for stream viewers, small enough that a slow viewer
+# can't have more than a frame or two waiting in it
+STREAM_SEND_BUFFER = 16 * 1024
+
+# asyncio.current_task is Python 3.7+, CI still runs 3.5
+_current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+INDEX_HTML = b'<html><head></head><body><img src="/cam.mjpg"/><img src="/cam.mjpg?overlay=1"/></body></html>'
+
+
+def parse_stream_options(query):
+    """Reads ?scale=0.5&quality=40&fps=5&overlay=1 style options into (Variant, max_fps).
+
+    Values are clamped to sane ranges and rounded so that near-identical
+    requests share one variant. Missing options keep the defaults.
+    """
+    options = parse_qs(query)
+
+    def _get(name, default, low, high):
+        try:
+            return min(max(float(options[name][0]), low), high)
+        except (KeyError, ValueError):
+            return default
+
+    scale = round(_get('scale', DEFAULT_VARIANT.scale, 0.1, 1.0), 1)
+    quality = int(_get('quality', DEFAULT_VARIANT.quality, 5, 95)) // 5 * 5
+    max_fps = _get('fps', None, 0.1, 60.0)
+    annotated = options.get('overlay', ['0'])[0] not in ('0', '', 'false')
+    return Variant(scale, quality, annotated), max_fps
+
+
+def _etag(seq, variant):
+    return '"%i-%g-%i%s"' % (seq, variant.scale, variant.quality, '-a' if variant.annotated else '')
+
+
+def _validators(etag, recv_time):
+    return [b'ETag: ' + etag.encode(),
+            b'Last-Modified: ' + formatdate(recv_time, usegmt=True).encode(),
+            b'Cache-Control: no-cache']
+
+
+class StreamServer:
+    """Serves frames from a FrameCache over HTTP on an asyncio event loop.
+
+    Viewers sleep until the cache publishes a new frame and then always get
+    the newest one, so a slow viewer skips frames instead of queueing them.
+    Query options on the .mjpg path pick a shared scale/quality variant, raw
+    or annotated frames and an optional frame rate cap (see
+    parse_stream_options).
+    A viewer that hangs up, or stops reading for write_timeout seconds, is
+    dropped.
+
+    /latest.jpg serves the newest frame on its own, with an ETag built from
+    the frame sequence number, so pollers on a kept-alive connection get a
+    tiny 304 until a new frame exists.
+
+    If a Metrics instance is given, per-viewer write times, lag and skipped
+    frames are recorded into it and it is served at /metrics.
+    """
+
+    def __init__(self, frame_cache, host='localhost', port=8087, write_timeout=5.0, keep_alive_timeout=15.0,
+                 metrics=None):
+        self.frame_cache = frame_cache
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.write_timeout = write_timeout
+        self.keep_alive_timeout = keep_alive_timeout
+        self.clients = set()
+        self._next_client_id = 0
+        self._loop = None
+        self._server = None
+        self._frame_event = None
+
+    async def start(self):
+        """Starts listening on the running event loop."""
+        self._loop = asyncio.get_event_loop()
+        self._frame_event = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.frame_cache.add_listener(self._on_publish)
+        if self.metrics:
+            self.metrics.set_gauge('clients', lambda: len(self.clients))
+        print("server started")
+
+    def close(self):
+        self.frame_cache.remove_listener(self._on_publish)
+        self._server.close()
+
+    def _on_publish(self):
+        # may be called from any thread, so hop onto our loop first
+        self._loop.call_soon_threadsafe(self._wake_clients)
+
+    def _wake_clients(self):
+        event, self._frame_event = self._frame_event, asyncio.Event()
+        event.set()
+
+    async def _next_frame(self, last_seq, variant=DEFAULT_VARIANT):
+        while self.frame_cache.seq == last_seq:
+            await self._frame_event.wait()
+        frame = self.frame_cache.cached(variant)
+        if frame is None:
+            # first viewer to see this frame pays for the encode, off the loop
+            frame = await self._loop.run_in_executor(None, self.frame_cache.latest, variant)
+        return frame
+
+    async def _read_request(self, reader):
+        """Returns (method, target, version, headers) or None once the client goes away."""
+        request_line = await asyncio.wait_for(reader.readline(), self.keep_alive_timeout)
+        if not request_line:
+            return None
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.keep_alive_timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        method, target, version = request_line.decode('latin-1').split()
+        return method, target, version, headers
+
+    async def _handle_client(self, reader, writer):
+        task = _current_task()
+        self.clients.add(task)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers = request
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                url = urlsplit(target)
+                path = url.path
+                if method != 'GET':
+                    await self._send(writer, b'405 Method Not Allowed', b'text/plain', b'', keep_alive)
+                elif path.endswith('.mjpg'):
+                    variant, max_fps = parse_stream_options(url.query)
+                    await self._stream(reader, writer, variant, max_fps)
+                    break
+                elif path == '/latest.jpg':
+                    variant, _ = parse_stream_options(url.query)
+                    await self._snapshot(writer, headers, variant, keep_alive)
+                elif path == '/metrics' and self.metrics:
+                    await self._send(writer, b'200 OK', b'text/plain; version=0.0.4',
+                                     self.metrics.render().encode(), keep_alive)
+                elif path.endswith('.html'):
+                    await self._send(writer, b'200 OK', b'text/html', INDEX_HTML, keep_alive)
+                else:
+                    await self._send(writer, b'404 Not Found', b'text/plain', b'', keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(task)
+            writer.close()
+
+    async def _send(self, writer, status, content_type, body, keep_alive=False, extra_headers=()):
+        head = [b'HTTP/1.1 ' + status,
+                b'Content-type: ' + content_type,
+                b'Content-length: ' + str(len(body)).encode(),
+                b'Connection: ' + (b'keep-alive' if keep_alive else b'close')]
+        head.extend(extra_headers)
+        writer.write(b'\r\n'.join(head) + b'\r\n\r\n' + body)
+        await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+    async def _snapshot(self, writer, headers, variant, keep_alive):
+        """Serves the newest frame, or 304 Not Modified if the client already has it."""
+        seq, recv_time = self.frame_cache.current()
+        if seq == 0:
+            await self._send(writer, b'503 Service Unavailable', b'text/plain', b'no frame yet', keep_alive)
+            return
+        etag = _etag(seq, variant)
+
+        # only the ETag tells frames apart: HTTP dates have 1 second resolution,
+        # so If-Modified-Since can't tell whether a newer frame arrived within
+        # that second and is ignored, which RFC 7232 allows
+        match = headers.get('if-none-match', '')
+        if etag in [tag.strip() for tag in match.split(',')]:
+            await self._send(writer, b'304 Not Modified', b'image/jpeg', b'', keep_alive,
+                             _validators(etag, recv_time))
+            return
+
+        frame = self.frame_cache.cached(variant)
+        if frame is None:
+            frame = await self._loop.run_in_executor(None, self.frame_cache.latest, variant)
+        etag = _etag(frame.seq, variant)
+        await self._send(writer, b'200 OK', b'image/jpeg', frame.jpeg, keep_alive,
+                         _validators(etag, frame.recv_time))
+
+    async def _stream(self, reader, writer, variant=DEFAULT_VARIANT, max_fps=None):
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Connection: close\r\n'
+                     b'Content-type: multipart/x-mixed-replace; boundary=' + BOUNDARY + b'\r\n\r\n')
+        # drain() only returns once everything is handed to the kernel, and the
+        # kernel only holds a little, so a slow viewer waits in drain() and then
+        # skips straight to the newest frame in _next_frame instead of queueing
+        writer.transport.set_write_buffer_limits(high=0)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_SEND_BUFFER)
+        # the viewer never sends anything else, so EOF means it hung up
+        stream_task = _current_task()
+
+        def _hung_up(_):
+            stream_task.cancel()
+
+        hangup = asyncio.ensure_future(reader.read())
+        hangup.add_done_callback(_hung_up)
+        self.frame_cache.subscribe(variant)
+        self._next_client_id += 1
+        client = str(self._next_client_id)
+        try:
+            last_seq = 0
+            next_send = 0
+            while True:
+                if max_fps:
+                    await asyncio.sleep(max(next_send - time.monotonic(), 0))
+                    next_send = time.monotonic() + 1.0 / max_fps
+                frame = await self._next_frame(last_seq, variant)
+                start = time.perf_counter()
+                writer.write(b'--' + BOUNDARY + b'\r\n'
+                             b'Content-type: image/jpeg\r\n'
+                             b'Content-length: ' + str(len(frame.jpeg)).encode() + b'\r\n'
+                             b'X-Timestamp: ' + repr(frame.recv_time).encode() + b'\r\n\r\n')
+                writer.write(frame.jpeg)
+                writer.write(b'\r\n')
+                await asyncio.wait_for(writer.drain(), self.write_timeout)
+                if self.metrics:
+                    self.metrics.time('write', start)
+                    if last_seq and frame.seq - last_seq > 1:
+                        self.metrics.inc('client_skipped_frames_total', frame.seq - last_seq - 1)
+                    self.metrics.set_gauge('client_lag_frames', self.frame_cache.seq - frame.seq, client=client)
+                last_seq = frame.seq
+        finally:
+            if self.metrics:
+                self.metrics.remove_gauge('client_lag_frames', client=client)
+            self.frame_cache.unsubscribe(variant)
+            hangup.remove_done_callback(_hung_up)
+            hangup.cancel()
@@ -1,105 +1,98 @@
 import argparse
 import asyncio
 import os
-import threading
 import time
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from io import BytesIO
-from socketserver import ThreadingMixIn
 
 import cozmo
-import cv2
-import numpy as np
 from cozmo.util import distance_mm, degrees, speed_mmps
 
+from frame_cache import FrameCache
+from metrics import Metrics
+from overlays import Overlays
+from recorder import POLICIES, DROP_OLDEST, RecordingWriter
+from replay import ReplaySource
+from segments import SegmentedSink
+from stream_server import StreamServer
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--dont-save', action="store_true", help="don't write the video file")
 parser.add_argument('--square', action="store_true", help="drive in a square instead of sitting still")
+parser.add_argument('--record-queue', type=int, default=30, help="frames the recorder may buffer before dropping")
+parser.add_argument('--record-policy', choices=POLICIES, default=DROP_OLDEST,
+                    help="what to do with frames when the recording queue is full")
+parser.add_argument('--segment-mb', type=float, default=64, help="start a new recording segment after this many MB")
+parser.add_argument('--segment-seconds', type=float, default=300,
+                    help="start a new recording segment after this many seconds")
+parser.add_argument('--replay', metavar='PATH', help="serve a recording instead of connecting to Cozmo")
+parser.add_argument('--replay-speed', type=float, default=1.0, help="multiple of the recorded frame rate, 0 for max")
 args = parser.parse_args()
 
 now = datetime.now()
 stamp = now.strftime("%d-%m-%y_%H-%M-%S")
-filename = os.path.join("videos", stamp + "_out.avi")
-video = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'), 15, (320, 240))
+filename = os.path.join("videos", stamp + "_*.mjpeg")
 
-pil_img = None
+metrics = Metrics()
+metrics.add_process_gauges()
+overlays = Overlays()
+frame_cache = FrameCache(metrics, overlays)
+recorder = None
 
 if not args.dont_save:
     print("Writing to", filename)
-
-
-class CamHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        global pil_img
-        if self.path.endswith('.mjpg'):
-            self.send_response(200)
-            self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=--jpgboundary')
-            self.end_headers()
-            while True:
-                try:
-                    tmpFile = BytesIO()
-                    pil_img.save(tmpFile, 'JPEG')
-                    self.wfile.write("--jpgboundary".encode())
-                    self.send_header('Content-type', 'image/jpeg')
-                    self.send_header('Content-length', str(tmpFile.getbuffer().nbytes))
-                    self.end_headers()
-                    pil_img.save(self.wfile, 'JPEG')
-                    time.sleep(0.05)
-                except KeyboardInterrupt:
-                    break
-            return
-        if self.path.endswith('.html'):
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write('<html><head></head><body>'.encode())
-            self.wfile.write('<img src="http://127.0.0.1:8087/cam.mjpg"/>'.encode())
-            self.wfile.write('</body></html>'.encode())
-            return
-
-
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """Handle requests in a separate thread."""
+    sink = SegmentedSink("videos", stamp, int(args.segment_mb * 1024 * 1024), args.segment_seconds)
+    recorder = RecordingWriter(sink, args.record_queue, args.record_policy, metrics)
 
 
 def new_image_handler(evt, obj=None, tap_cout=None, **kwargs):
-    # print(evt.image.image_recv_time)
-    global pil_img
-    pil_img = evt.image.raw_image
-    if not args.dont_save:
-        video.write(cv2.cvtColor(np.array(evt.image.raw_image), cv2.COLOR_RGB2BGR))
+    metrics.observe('receive', time.time() - evt.image.image_recv_time)
+    frame_cache.publish(evt.image.raw_image, evt.image.image_recv_time)
+    if recorder:
+        recorder.submit(evt.image.raw_image, evt.image.image_recv_time)
 
 
-def camera_server():
-    try:
-        server = ThreadedHTTPServer(('localhost', 8087), CamHandler)
-        print("server started")
-        server.serve_forever()
-    except KeyboardInterrupt:
-        server.socket.close()
+def object_observed_handler(evt, **kwargs):
+    box = evt.image_box
+    overlays.set_boxes('object-%s' % evt.obj.object_id,
+                       [(box.top_left_x, box.top_left_y, box.top_left_x + box.width, box.top_left_y + box.height)],
+                       'cyan', ttl=0.5, labels=[str(evt.obj.object_id)])
 
 
 async def program(robot: cozmo.robot.Robot):
     robot.camera.image_stream_enabled = True
     robot.world.add_event_handler(cozmo.world.EvtNewCameraImage, new_image_handler)
+    robot.world.add_event_handler(cozmo.objects.EvtObjectObserved, object_observed_handler)
 
-    thread = threading.Thread(target=camera_server)
-    thread.start()
+    # serve viewers from the SDK's own event loop
+    server = StreamServer(frame_cache, 'localhost', 8087, metrics=metrics)
+    await server.start()
 
     if args.square:
         for _ in range(4):
-            robot.drive_straight(distance_mm(150), speed_mmps(50)).wait_for_completed()
-            robot.turn_in_place(degrees(90)).wait_for_completed()
-    else:
-        while True:
-            await asyncio.sleep(1)
+            await robot.drive_straight(distance_mm(150), speed_mmps(50)).wait_for_completed()
+            await robot.turn_in_place(degrees(90)).wait_for_completed()
 
-    thread.join()
+    while True:
+        await asyncio.sleep(1)
+
+
+async def replay_program():
+    server = StreamServer(frame_cache, 'localhost', 8087, metrics=metrics)
+    await server.start()
+    stats = await ReplaySource(args.replay, args.replay_speed or None).play_async(new_image_handler)
+    print("Replay:", stats)
+    server.close()
 
 
 cozmo.robot.Robot.drive_off_charger_on_connect = False
-if args.square:
-    cozmo.run_program(program)
-else:
-    cozmo.run_program(program, use_3d_viewer=True, use_viewer=True)
+try:
+    if args.replay:
+        asyncio.get_event_loop().run_until_complete(replay_program())
+    elif args.square:
+        cozmo.run_program(program)
+    else:
+        cozmo.run_program(program, use_3d_viewer=True, use_viewer=True)
+finally:
+    if recorder:
+        recorder.close()
+        print("Recording:", recorder.stats())